@@ -1,17 +1,102 @@
 import os
-from datetime import datetime
+import re
+import json
+import time
+import base64
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from boto3.dynamodb.conditions import Key
 import boto3
 
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+# query parameters that only track where a click came from
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_hsenc', '_hsmi', 'ref_src',
+}
+# a scheme like https: or mailto:, but not the port of a bare host:8080
+SCHEME_RE = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*:(?!\d)')
+
+def canonical_url(url):
+    """
+    The url used to tell whether a link was already saved: https, lower case
+    host without www. or the default port, no trailing slash, fragment or
+    tracking parameters, and the remaining parameters sorted. Urls without a
+    scheme are taken as https, other schemes are kept as they are.
+    """
+    url = url.strip()
+    if not SCHEME_RE.match(url):
+        url = f'https://{url}'
+    parts = urlsplit(url)
+    host = (parts.hostname or '').rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in (80, 443):
+        host = f'{host}:{port}'
+    path = parts.path.rstrip('/') or '/'
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    )
+    scheme = 'https' if parts.scheme.lower() in ('http', 'https') else parts.scheme.lower()
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
 class DynamoDatabase:
     def __init__(self):
-        dynamodb = boto3.resource('dynamodb')
-        self.table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+        self.dynamodb = boto3.resource('dynamodb')
+        self.table = self.dynamodb.Table(os.environ['DYNAMODB_TABLE'])
 
         self.pk = 'URL'
         self.sk_prefix = 'LINK#'
+        # sits in the same partition, outside the LINK# prefix
+        self.count_key = {'pk': self.pk, 'sk': 'COUNT'}
+        # one item per canonical url, in its own partition, to find saved links
+        self.url_index_prefix = 'URLIDX#'
+
+    def url_index_key(self, url):
+        return {'pk': f'{self.url_index_prefix}{canonical_url(url)}', 'sk': 'URLIDX'}
+
+    def find_url(self, url):
+        """
+        The saved link for the url, or a variant of it with the same
+        canonical url, or None.
+        """
+        response = self.table.get_item(Key=self.url_index_key(url))
+        item = response.get('Item')
+        if item is None:
+            return None
+        return {'url': item['url'], 'title': item['title'], 'summary': item['summary']}
 
     def save_url(self, url, title, summary):
+        """
+        Save a link, unless its canonical url is already saved. Returns
+        whether it was saved.
+        """
+        try:
+            # claims the canonical url first, so two saves of the same link
+            # can't both add it
+            self.table.put_item(
+                Item=dict(self.url_index_key(url), url=url, title=title, summary=summary),
+                ConditionExpression='attribute_not_exists(pk)',
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
         self.table.put_item(
             Item={
                 'pk': self.pk,
@@ -21,29 +106,375 @@ class DynamoDatabase:
                 'summary': summary,
             }
         )
+        self.table.update_item(
+            Key=self.count_key,
+            UpdateExpression='ADD link_count :one SET updated_at = :now',
+            ExpressionAttributeValues={':one': 1, ':now': datetime.now(timezone.utc).isoformat()},
+        )
+        return True
+
+    def save_urls(self, items):
+        """
+        Save many links with batched writes, skipping the ones whose
+        canonical url is already saved. Unlike save_url, a link saved by
+        another process at the same moment can get in twice. Returns the
+        saved items.
+        """
+        unique = {}
+        for item in items:
+            unique.setdefault(canonical_url(item['url']), item)
+        keys = [self.url_index_key(item['url']) for item in unique.values()]
 
-    def get_links(self):
-        response = self.table.query(
-            KeyConditionExpression=Key('pk').eq(self.pk) & Key('sk').begins_with(self.sk_prefix),
-            ScanIndexForward=False
+        known = set()
+        # batch_get_item reads up to 100 keys at a time
+        for start in range(0, len(keys), 100):
+            request = {self.table.name: {'Keys': keys[start:start + 100], 'ProjectionExpression': 'pk'}}
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                known.update(found['pk'] for found in response['Responses'].get(self.table.name, []))
+                request = response.get('UnprocessedKeys')
+
+        new = [item for key, item in zip(keys, unique.values()) if key['pk'] not in known]
+        if not new:
+            return []
+        # batch_writer sends 25 puts per request and retries unprocessed ones
+        with self.table.batch_writer() as batch:
+            for item in new:
+                link = {'url': item['url'], 'title': item['title'], 'summary': item['summary']}
+                batch.put_item(Item=dict(self.url_index_key(item['url']), **link))
+                batch.put_item(Item=dict(link, pk=self.pk, sk=f'{self.sk_prefix}{datetime.now().isoformat()}#{item["url"]}'))
+        self.table.update_item(
+            Key=self.count_key,
+            UpdateExpression='ADD link_count :n SET updated_at = :now',
+            ExpressionAttributeValues={':n': len(new), ':now': datetime.now(timezone.utc).isoformat()},
         )
+        return new
+
+    def count_links(self):
+        response = self.table.get_item(Key=self.count_key)
+        return int(response.get('Item', {}).get('link_count', 0))
 
-        return response['Items'] or []
+    def last_modified(self):
+        """
+        When a link was last saved, or None. A single item read, so it is a
+        cheap way to tell whether anything changed.
+        """
+        response = self.table.get_item(Key=self.count_key, ProjectionExpression='updated_at')
+        updated_at = response.get('Item', {}).get('updated_at')
+        return datetime.fromisoformat(updated_at) if updated_at else None
+
+    def reconcile_count(self):
+        """
+        Recount the links and fix the counter if it drifted, e.g. when a
+        save_url failed between writing the link and updating the counter.
+        Returns (old count, actual count).
+        """
+        query = {
+            'KeyConditionExpression': Key('pk').eq(self.pk) & Key('sk').begins_with(self.sk_prefix),
+            'Select': 'COUNT',
+        }
+        actual = 0
+        while True:
+            response = self.table.query(**query)
+            actual += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                break
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        old = self.count_links()
+        if old != actual:
+            # update, not put, to keep updated_at on the counter item
+            self.table.update_item(
+                Key=self.count_key,
+                UpdateExpression='SET link_count = :n',
+                ExpressionAttributeValues={':n': actual},
+            )
+        return old, actual
+
+    def reindex_urls(self):
+        """
+        Add the links saved before the url index existed to it. Returns the
+        number of links added.
+        """
+        items, _ = self.get_links()
+        added = 0
+        # oldest first, so the first save of a link is the one kept
+        for item in reversed(items):
+            try:
+                self.table.put_item(
+                    Item=dict(self.url_index_key(item['url']), url=item['url'], title=item['title'], summary=item['summary']),
+                    ConditionExpression='attribute_not_exists(pk)',
+                )
+                added += 1
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                pass
+        return added
+
+    def get_links(self, limit=None, cursor=None):
+        """
+        Returns (links, next_cursor) in reverse chronological order. Without a
+        limit every page of the partition is fetched. next_cursor is None on
+        the last page.
+        """
+        query = {
+            'KeyConditionExpression': Key('pk').eq(self.pk) & Key('sk').begins_with(self.sk_prefix),
+            'ScanIndexForward': False,
+        }
+        if limit:
+            query['Limit'] = limit
+        if cursor:
+            query['ExclusiveStartKey'] = decode_cursor(cursor)
+
+        response = self.table.query(**query)
+        items = response['Items'] or []
+        last_key = response.get('LastEvaluatedKey')
+
+        # a single query stops at 1MB, keep going until we have everything
+        while last_key and not limit:
+            query['ExclusiveStartKey'] = last_key
+            response = self.table.query(**query)
+            items.extend(response['Items'] or [])
+            last_key = response.get('LastEvaluatedKey')
+
+        return items, encode_cursor(last_key) if last_key else None
 
 class InMemoryDatabase:
     def __init__(self):
         self.data = []
+        self.by_url = {}
+        self.updated_at = None
+
+    def find_url(self, url):
+        return self.by_url.get(canonical_url(url))
 
     def save_url(self, url, title, summary):
-        self.data.append({
+        key = canonical_url(url)
+        if key in self.by_url:
+            return False
+        item = {
             'url': url,
             'title': title,
             'summary': summary,
-        })
+        }
+        self.data.append(item)
+        self.by_url[key] = item
+        self.updated_at = datetime.now(timezone.utc)
+        return True
+
+    def save_urls(self, items):
+        return [item for item in items if self.save_url(item['url'], item['title'], item['summary'])]
+
+    def last_modified(self):
+        return self.updated_at
+
+    def count_links(self):
+        return len(self.data)
+
+    def reconcile_count(self):
+        return len(self.data), len(self.data)
+
+    def get_links(self, limit=None, cursor=None):
+        # reverse chronological order, the cursor is the index of the next
+        # (older) item so new links don't shift the pages
+        start = len(self.data) - 1
+        if cursor:
+            start = decode_cursor(cursor)
+            if type(start) is not int or not 0 <= start < len(self.data):
+                raise ValueError(f"Invalid cursor: {cursor}")
+        end = max(start + 1 - limit, 0) if limit else 0
+
+        items = self.data[end:start + 1][::-1]
+        return items, encode_cursor(end - 1) if end > 0 else None
+
+    def search_links(self, query, limit=50, cursor=None):
+        words = [word.lower() for word in query.split()]
+        if not words:
+            return [], None
+        offset = decode_cursor(cursor) if cursor else 0
+        if type(offset) is not int or offset < 0:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        matches = [
+            item for item in reversed(self.data)
+            if all(word in f"{item['title']} {item['summary']}".lower() for word in words)
+        ]
+        items = matches[offset:offset + limit]
+        return items, encode_cursor(offset + limit) if len(matches) > offset + limit else None
+
+class SqliteDatabase:
+    """
+    Links in a local sqlite database, for self hosting without AWS. Any
+    number of threads and processes on the machine can share the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS links (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                canonical_url TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS links_created_at ON links (created_at, id);
+        ''')
+        try:
+            # keyword search over the titles and summaries, kept in step with
+            # the links table by triggers
+            conn.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS links_fts USING fts5(
+                    title, summary, content='links', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS links_fts_insert AFTER INSERT ON links BEGIN
+                    INSERT INTO links_fts (rowid, title, summary) VALUES (new.id, new.title, new.summary);
+                END;
+                CREATE TRIGGER IF NOT EXISTS links_fts_delete AFTER DELETE ON links BEGIN
+                    INSERT INTO links_fts (links_fts, rowid, title, summary) VALUES ('delete', old.id, old.title, old.summary);
+                END;
+                CREATE TRIGGER IF NOT EXISTS links_fts_update AFTER UPDATE ON links BEGIN
+                    INSERT INTO links_fts (links_fts, rowid, title, summary) VALUES ('delete', old.id, old.title, old.summary);
+                    INSERT INTO links_fts (rowid, title, summary) VALUES (new.id, new.title, new.summary);
+                END;
+            ''')
+            self.fts = True
+        except sqlite3.OperationalError:
+            # sqlite built without fts5, search falls back to LIKE
+            self.fts = False
+
+    def connection(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def find_url(self, url):
+        row = self.connection().execute(
+            'SELECT url, title, summary FROM links WHERE canonical_url = ?', (canonical_url(url),)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def save_url(self, url, title, summary):
+        cursor = self.connection().execute(
+            'INSERT OR IGNORE INTO links (url, canonical_url, title, summary, created_at) VALUES (?, ?, ?, ?, ?)',
+            (url, canonical_url(url), title, summary, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def save_urls(self, items):
+        """
+        Save many links in one transaction, skipping the ones already saved.
+        Returns the saved items.
+        """
+        conn = self.connection()
+        saved = []
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for item in items:
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO links (url, canonical_url, title, summary, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (item['url'], canonical_url(item['url']), item['title'], item['summary'], now)
+                )
+                if cursor.rowcount == 1:
+                    saved.append(item)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return saved
+
+    def last_modified(self):
+        row = self.connection().execute('SELECT MAX(created_at) FROM links').fetchone()
+        return datetime.fromtimestamp(row[0], timezone.utc) if row[0] is not None else None
+
+    def count_links(self):
+        return self.connection().execute('SELECT COUNT(*) FROM links').fetchone()[0]
+
+    def reconcile_count(self):
+        count = self.count_links()
+        return count, count
+
+    def get_links(self, limit=None, cursor=None):
+        """
+        Returns (links, next_cursor) in reverse chronological order. The
+        cursor is the (created_at, id) of the last link on the page, so new
+        links don't shift the pages.
+        """
+        query = 'SELECT id, url, title, summary, created_at FROM links'
+        params = []
+        if cursor:
+            position = decode_cursor(cursor)
+            if (not isinstance(position, list) or len(position) != 2
+                    or type(position[0]) not in (int, float) or type(position[1]) is not int):
+                raise ValueError(f"Invalid cursor: {cursor}")
+            query += ' WHERE (created_at, id) < (?, ?)'
+            params += position
+        query += ' ORDER BY created_at DESC, id DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+
+        rows = [dict(row) for row in self.connection().execute(query, params)]
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            return rows, encode_cursor([rows[-1]['created_at'], rows[-1]['id']])
+        return rows, None
+
+    def search_links(self, query, limit=50, cursor=None):
+        """
+        Links matching every word of the query, best match first. Returns
+        (links, next_cursor) like get_links, the cursor is an offset.
+        """
+        words = query.split()
+        if not words:
+            return [], None
+        offset = decode_cursor(cursor) if cursor else 0
+        if type(offset) is not int or offset < 0:
+            raise ValueError(f"Invalid cursor: {cursor}")
 
-    def get_links(self):
-        # reverse chronological order
-        return self.data[::-1]
+        if self.fts:
+            # every word quoted, so the query can't be fts syntax, and matched
+            # as a prefix for searching while typing
+            match = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+            rows = self.connection().execute(
+                '''SELECT links.id, links.url, links.title, links.summary, links.created_at
+                   FROM links_fts JOIN links ON links.id = links_fts.rowid
+                   WHERE links_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?''',
+                (match, limit + 1, offset)
+            ).fetchall()
+        else:
+            where = ' AND '.join(['(title LIKE ? OR summary LIKE ?)'] * len(words))
+            params = [f'%{word}%' for word in words for _ in range(2)]
+            rows = self.connection().execute(
+                f'''SELECT id, url, title, summary, created_at FROM links WHERE {where}
+                    ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?''',
+                params + [limit + 1, offset]
+            ).fetchall()
 
+        rows = [dict(row) for row in rows]
+        if len(rows) > limit:
+            return rows[:limit], encode_cursor(offset + limit)
+        return rows, None
 
 
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ['reconcile-count']:
+        old, actual = DynamoDatabase().reconcile_count()
+        if old == actual:
+            print(f"Link count is correct: {actual}")
+        else:
+            print(f"Fixed link count: {old} -> {actual}")
+    elif sys.argv[1:] == ['reindex-urls']:
+        print(f"Added {DynamoDatabase().reindex_urls()} links to the url index")
+    else:
+        print("Usage: python database.py reconcile-count|reindex-urls")
+        sys.exit(1)
@@ -0,0 +1,206 @@
+# Approximate nearest neighbour index (IVF) for related article lookups.
+#
+# The vectors are split into `nlist` lists by their nearest centroid, and a
+# query only scores the vectors in the `nprobe` lists closest to it. Built and
+# queried locally, no external service.
+#
+# On disk, in one directory:
+#
+#   meta.json      dim, nlist and the number of committed vectors
+#   centroids.npy  nlist x dim float32
+#   vectors.f32    raw normalized float32 vectors, appended on insert
+#   lists.i32      raw int32 list of every vector, appended on insert
+#   links.txt      one link per vector
+#
+# The raw files are memory mapped on load, so any number of processes can
+# share one index without reading it all into memory. Inserts append to the
+# files and then update meta.json, which is what readers trust.
+#
+#   python annindex.py related <index dir> <link> [k]
+import json
+import os
+import sys
+
+import numpy as np
+
+VERSION = 1
+DEFAULT_NPROBE = 8
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def default_nlist(n):
+    return int(max(1, min(n, 4 * np.sqrt(n))))
+
+
+class AnnIndex:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != VERSION:
+            raise ValueError(f"Unsupported index version {meta['version']} in {path}")
+        self.dim = meta['dim']
+        self.nlist = meta['nlist']
+        self.count = meta['count']
+        self.trained_count = meta['trained_count']
+        self.centroids = np.load(os.path.join(path, 'centroids.npy'))
+        with open(os.path.join(path, 'links.txt')) as f:
+            links = f.read().split('\n')[:self.count]
+        self.links = links
+        self.positions = {link: i for i, link in enumerate(links)}
+        self._map()
+
+    @classmethod
+    def build(cls, path, vectors, links, nlist=None, random_state=0):
+        from sklearn.cluster import MiniBatchKMeans
+
+        vectors = normalize(vectors)
+        nlist = nlist or default_nlist(len(vectors))
+        kmeans = MiniBatchKMeans(n_clusters=nlist, n_init=3, batch_size=4096, random_state=random_state)
+        lists = kmeans.fit_predict(vectors).astype(np.int32)
+        centroids = normalize(kmeans.cluster_centers_)
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'centroids.npy'), centroids)
+        vectors.tofile(os.path.join(path, 'vectors.f32'))
+        lists.tofile(os.path.join(path, 'lists.i32'))
+        with open(os.path.join(path, 'links.txt'), 'w') as f:
+            f.write('\n'.join(links))
+        cls._write_meta(path, {
+            'version': VERSION,
+            'dim': vectors.shape[1],
+            'nlist': nlist,
+            'count': len(vectors),
+            'trained_count': len(vectors),
+        })
+        return cls(path)
+
+    @staticmethod
+    def _write_meta(path, meta):
+        meta_file = os.path.join(path, 'meta.json')
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    def _map(self):
+        if self.count == 0:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+            self.lists = np.empty((0,), dtype=np.int32)
+            self.order = self.lists
+            self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+            return
+        self.vectors = np.memmap(os.path.join(self.path, 'vectors.f32'), dtype=np.float32,
+                                 mode='r', shape=(self.count, self.dim))
+        self.lists = np.memmap(os.path.join(self.path, 'lists.i32'), dtype=np.int32,
+                               mode='r', shape=(self.count,))
+        # inverted lists: the ids of every list are order[offsets[l]:offsets[l + 1]]
+        self.order = np.argsort(self.lists, kind='stable')
+        self.offsets = np.searchsorted(self.lists[self.order], np.arange(self.nlist + 1))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, link):
+        return link in self.positions
+
+    def needs_rebuild(self, growth=4):
+        # the centroids were trained on the first vectors only
+        return self.count > growth * self.trained_count
+
+    def insert(self, vectors, links):
+        """
+        Append new vectors. Links already in the index are skipped.
+        """
+        vectors = normalize(vectors)
+        keep = []
+        for i, link in enumerate(links):
+            if link not in self.positions:
+                self.positions[link] = self.count + len(keep)
+                keep.append(i)
+        if not keep:
+            return 0
+        vectors = vectors[keep]
+        new_links = [links[i] for i in keep]
+        lists = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+        # drop anything past the committed count, left over from a crashed insert
+        for name, itemsize in [('vectors.f32', 4 * self.dim), ('lists.i32', 4)]:
+            with open(os.path.join(self.path, name), 'r+b') as f:
+                f.truncate(self.count * itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(vectors.tobytes() if name == 'vectors.f32' else lists.tobytes())
+        with open(os.path.join(self.path, 'links.txt'), 'w') as f:
+            f.write('\n'.join(self.links + new_links))
+
+        self.links = self.links + new_links
+        self.count += len(new_links)
+        self._write_meta(self.path, {
+            'version': VERSION,
+            'dim': self.dim,
+            'nlist': self.nlist,
+            'count': self.count,
+            'trained_count': self.trained_count,
+        })
+        self._map()
+        return len(new_links)
+
+    def search(self, query_vectors, k=10, nprobe=DEFAULT_NPROBE, exclude=None):
+        """
+        Returns, for every query, a list of (link, score) for the k nearest
+        vectors found in the nprobe closest lists, best first.
+        """
+        queries = normalize(query_vectors)
+        nprobe = min(nprobe, self.nlist)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, lists in zip(queries, probes):
+            candidates = np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+            if exclude is not None:
+                candidates = candidates[candidates != exclude]
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            scores = self.vectors[candidates] @ query
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            results.append([(self.links[candidates[i]], float(scores[i])) for i in best])
+        return results
+
+    def related(self, link, k=10, nprobe=DEFAULT_NPROBE):
+        position = self.positions.get(link)
+        if position is None:
+            return []
+        return self.search(self.vectors[position], k, nprobe, exclude=position)[0]
+
+
+def update_index(path, vectors, links):
+    """
+    Add vectors to the index at `path`, building it if it does not exist yet
+    or the centroids are out of date.
+    """
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return AnnIndex.build(path, vectors, links)
+    index = AnnIndex(path)
+    index.insert(vectors, links)
+    if index.needs_rebuild():
+        print(f"Rebuilding ann index, grew from {index.trained_count} to {index.count} vectors")
+        return AnnIndex.build(path, np.asarray(index.vectors), index.links)
+    return index
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] != 'related':
+        print("Usage: python annindex.py related <index dir> <link> [k]")
+        sys.exit(1)
+    index = AnnIndex(sys.argv[2])
+    k = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+    for link, score in index.related(sys.argv[3], k):
+        print(f"{score:.3f}  {link}")
@@ -0,0 +1,55 @@
+# Recall and queries per second of the ivf index against brute force search,
+# on synthetic embeddings.
+#
+#   python bench_ann.py --rows 100000 --dim 1536
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import annindex
+from bench_cluster import make_embeddings
+
+
+def brute_force(matrix, queries, k):
+    scores = queries @ matrix.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--topics', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    matrix, _ = make_embeddings(args.rows, args.dim, args.topics)
+    links = [f"https://example.com/{i}" for i in range(args.rows)]
+    rng = np.random.default_rng(1)
+    queries = annindex.normalize(matrix[rng.choice(args.rows, args.queries, replace=False)]
+                                 + 0.05 * rng.standard_normal((args.queries, args.dim), dtype=np.float32))
+
+    start = time.perf_counter()
+    truth = brute_force(matrix, queries, args.k)
+    elapsed = time.perf_counter() - start
+    print(f"{args.rows} rows x {args.dim} dims, k={args.k}")
+    print(f"{'brute force':>14}: {args.queries / elapsed:9.1f} qps  recall 1.000")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        index = annindex.AnnIndex.build(tmp, matrix, links)
+        print(f"built {index.nlist} lists in {time.perf_counter() - start:.1f}s")
+
+        for nprobe in [1, 4, 8, 16, 32]:
+            start = time.perf_counter()
+            found = [index.search(query, args.k, nprobe)[0] for query in queries]
+            elapsed = time.perf_counter() - start
+            recall = np.mean([
+                len({int(link.rsplit('/', 1)[1]) for link, _ in result} & expected) / args.k
+                for result, expected in zip(found, truth)
+            ])
+            print(f"{'nprobe ' + str(nprobe):>14}: {args.queries / elapsed:9.1f} qps  recall {recall:.3f}")
@@ -0,0 +1,66 @@
+# Compare the clustering engines on synthetic embeddings: wall time, peak
+# memory and cluster quality.
+#
+#   python bench_cluster.py --rows 3000 --dim 1536
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+
+import engines
+
+
+def make_embeddings(rows, dim, topics, seed=42):
+    # unit vectors scattered around a handful of topic directions, roughly
+    # what ada-002 embeddings of related articles look like
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim), dtype=np.float32)
+    truth = rng.integers(0, topics, rows)
+    matrix = centers[truth] + 0.8 * rng.standard_normal((rows, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix, truth
+
+
+CONFIGS = [
+    ('gmm', 'none'),
+    ('gmm', 'pca'),
+    ('gmm-diag', 'pca'),
+    ('kmeans', 'pca'),
+    ('minibatch-kmeans', 'pca'),
+    ('minibatch-kmeans', 'svd'),
+]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=3000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--topics', type=int, default=40)
+    parser.add_argument('--reduce-dim', type=int, default=engines.DEFAULT_REDUCE_DIM)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--skip-full-gmm', action='store_true', help='the original engine is very slow on big inputs')
+    args = parser.parse_args()
+
+    matrix, truth = make_embeddings(args.rows, args.dim, args.topics)
+    n_clusters = max(args.rows // 6, 4)
+    print(f"{args.rows} rows x {args.dim} dims, {n_clusters} clusters, {args.topics} true topics")
+    print(f"{'engine':>18} {'reducer':>8} {'time':>9} {'peak MB':>9} {'silhouette':>11} {'ARI':>6}")
+
+    for engine, reducer in CONFIGS:
+        if args.skip_full_gmm and engine == 'gmm' and reducer == 'none':
+            continue
+        tracemalloc.start()
+        start = time.perf_counter()
+        labels, _, _ = engines.fit(matrix, n_clusters, engine=engine, reducer=reducer,
+                                   reduce_dim=args.reduce_dim, threads=args.threads)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # quality is always measured in the original embedding space
+        silhouette = silhouette_score(matrix, labels, metric='cosine',
+                                      sample_size=min(args.rows, 2000), random_state=0)
+        ari = adjusted_rand_score(truth, labels)
+        print(f"{engine:>18} {reducer:>8} {elapsed:8.2f}s {peak / 1e6:9.1f} {silhouette:11.3f} {ari:6.3f}")
@@ -0,0 +1,58 @@
+# Compare one request per text against the batched, concurrent embedding
+# pipeline, using the fake embedding server so no api key is needed.
+#
+#   python bench_embeddings.py --texts 2000 --latency 0.1
+import argparse
+import time
+
+import tiktoken
+
+import embedder
+from fake_embedding_server import start_server
+
+
+def make_texts(n):
+    words = "cluster feed article summary embedding vector redis python token batch".split()
+    return [
+        f"## Article {i}\nTags: #bench\n\n" + " ".join(words[(i + j) % len(words)] for j in range(150))
+        for i in range(n)
+    ]
+
+
+def run(name, texts, n_tokens, backend, **kwargs):
+    start = time.perf_counter()
+    embeddings = embedder.embed_texts(texts, n_tokens, backend, **kwargs)
+    elapsed = time.perf_counter() - start
+    assert len(embeddings) == len(texts) and all(e is not None for e in embeddings)
+    print(f"{name:>30}: {elapsed:8.2f}s  {len(texts) / elapsed:8.1f} texts/s")
+    return embeddings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--texts', type=int, default=1000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated seconds per request')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--batch-tokens', type=int, default=embedder.DEFAULT_MAX_BATCH_TOKENS)
+    args = parser.parse_args()
+
+    server, url, stats = start_server(dim=args.dim, latency=args.latency)
+    backend = embedder.HttpBackend('fake', url)
+
+    texts = make_texts(args.texts)
+    encoding = tiktoken.get_encoding("cl100k_base")
+    n_tokens = [len(encoding.encode(t)) for t in texts]
+
+    serial = run("one text per request", texts, n_tokens, backend,
+                 max_batch_size=1, concurrency=1)
+    print(f"{'':>30}  {stats['requests']} requests")
+    stats['requests'] = 0
+
+    batched = run(f"batched, concurrency {args.concurrency}", texts, n_tokens, backend,
+                  max_batch_tokens=args.batch_tokens, concurrency=args.concurrency)
+    print(f"{'':>30}  {stats['requests']} requests")
+
+    # results have to come back in input order
+    assert serial == batched
+    server.shutdown()
@@ -0,0 +1,85 @@
+# Compare load time and peak memory of the old csv format against the binary
+# vectorstore format, on synthetic data shaped like embeddings.py output.
+#
+#   python bench_vectorstore.py --rows 10000 --dim 1536
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import vectorstore
+
+
+def make_data(rows, dim):
+    rng = np.random.default_rng(42)
+    matrix = rng.standard_normal((rows, dim), dtype=np.float32)
+    meta = pd.DataFrame({
+        'title': [f"Article {i}" for i in range(rows)],
+        'summary': ["A summary of a few sentences about the article. " * 4] * rows,
+        'link': [f"https://example.com/{i}" for i in range(rows)],
+        'tags': ["#python #bench"] * rows,
+    })
+    meta['combined'] = "## " + meta.title + "\nTags: " + meta.tags + "\n\n" + meta.summary
+    return meta, matrix
+
+
+def load_csv_eval(path):
+    # what cluster.py used to do
+    df = pd.read_csv(path)
+    df["embedding"] = df.embedding.apply(eval).apply(np.array)
+    return np.vstack(df.embedding.values)
+
+
+def load_child(fmt, path):
+    start = time.perf_counter()
+    if fmt == 'csv-eval':
+        matrix = load_csv_eval(path)
+    elif fmt == 'csv':
+        meta, matrix = vectorstore.load(path)
+    else:
+        meta, matrix = vectorstore.load(path, mmap=(fmt == 'npy-mmap'))
+    # touch every row, as the clustering would
+    total = float(np.asarray(matrix).sum(dtype=np.float64))
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed} {peak_mb} {total}")
+
+
+def measure(fmt, path):
+    # a fresh process per format, so peak rss is not shared between them
+    out = subprocess.check_output([sys.executable, __file__, '--child', fmt, path])
+    elapsed, peak_mb, _ = out.decode().split()
+    return float(elapsed), float(peak_mb)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        load_child(*args.child)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        meta, matrix = make_data(args.rows, args.dim)
+        csv_file = os.path.join(tmp, 'legacy.csv')
+        bin_file = os.path.join(tmp, 'vectors')
+        vectorstore.export_csv(csv_file, meta, matrix)
+        vectorstore.save(bin_file, meta, matrix)
+        del meta, matrix
+
+        print(f"{args.rows} rows x {args.dim} dims")
+        print(f"csv size: {os.path.getsize(csv_file) / 1e6:.1f} MB")
+        print(f"npy size: {os.path.getsize(vectorstore.vectors_path(bin_file)) / 1e6:.1f} MB")
+        for fmt, path in [('csv-eval', csv_file), ('csv', csv_file), ('npy', bin_file), ('npy-mmap', bin_file)]:
+            elapsed, peak_mb = measure(fmt, path)
+            print(f"{fmt:>10}: load {elapsed:7.2f}s  peak rss {peak_mb:8.1f} MB")
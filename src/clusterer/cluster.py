@@ -7,34 +7,139 @@ import pandas as pd
 import pprint
 import json
 import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-clustered_posts = []
-# load data
-datafile_path = sys.argv[1]
-if datafile_path is None:
-    print("Usage: python cluster.py <datafile_path> <out_file>")
-    sys.exit(1)
+import engines
+import incremental
+import themecache
+import vectorstore
+import visualize
 
-out_file = sys.argv[2]
-if out_file is None:
-    print("Usage: python cluster.py <datafile_path> <out_file>")
-    sys.exit(1)
 
-df = pd.read_csv(datafile_path)
-# group by link
-df = df.groupby("link").first().reset_index()
+# errors that retrying won't fix
+FATAL_ERRORS = (
+    openai.error.AuthenticationError,
+    openai.error.PermissionError,
+    openai.error.InvalidRequestError,
+)
 
-print(df.head())
-df["embedding"] = df.embedding.apply(eval).apply(np.array)  # convert string to numpy array
-matrix = np.vstack(df.embedding.values)
-matrix.shape
 
-from sklearn.cluster import KMeans, DBSCAN, SpectralClustering, AgglomerativeClustering, Birch
-from sklearn.mixture import GaussianMixture
+def get_cluster_theme(posts):
+    num_tries = 4
+    sleep_time = 1.4
+    while True:
+        try:
+            response = openai.ChatCompletion.create(
+                model="gpt-3.5-turbo-16k",
+                messages=[
+                    {
+                        "role":"user",
+                        "content":f'What do the following posts have in common. Provide one short sentence capturing the common theme of the posts.\n\nPosts:\n"""\n{posts}\n"""\n\nTheme:'
+                    }
+                ],
+                temperature=0,
+                max_tokens=64,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0,
+            )
+            return response["choices"][0]["message"]["content"]
+        except FATAL_ERRORS:
+            raise
+        except Exception as e:
+            num_tries -= 1
+            if num_tries == 0:
+                raise e
+            print(f"Error: {e}. Sleeping for {sleep_time} seconds.")
+            time.sleep(sleep_time)
+            sleep_time *= 2
+
+
+def get_cluster_themes(cluster_posts, concurrency):
+    """
+    Get the themes of many clusters at once, at most `concurrency` requests
+    at a time. `cluster_posts` maps a cluster to its posts text. As soon as
+    one cluster fails for good the remaining requests are cancelled.
+    """
+    themes = {}
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        futures = {pool.submit(get_cluster_theme, posts): cluster for cluster, posts in cluster_posts.items()}
+        try:
+            for future in as_completed(futures):
+                themes[futures[future]] = future.result()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    return themes
+
+
+clustered_posts = []
+
+parser = argparse.ArgumentParser(description='Cluster embedded articles and give every cluster a theme')
+parser.add_argument('datafile_path', help='output of embeddings.py, binary .npy files or the old csv format')
+parser.add_argument('out_file')
+parser.add_argument('--export-csv', default=None, help='also write the clustered articles to this csv file')
+parser.add_argument('--engine', default=engines.DEFAULT_ENGINE, choices=engines.ENGINES,
+                    help='clustering algorithm, gmm is the old full covariance mixture')
+parser.add_argument('--reducer', default=engines.DEFAULT_REDUCER, choices=engines.REDUCERS,
+                    help='dimensionality reduction applied before clustering')
+parser.add_argument('--reduce-dim', type=int, default=engines.DEFAULT_REDUCE_DIM,
+                    help='number of dimensions to reduce the embeddings to')
+parser.add_argument('--threads', type=int, default=None,
+                    help='limit the number of threads used by numpy and sklearn')
+parser.add_argument('--model-file', default=None,
+                    help='save the fitted model, assignments and themes here')
+parser.add_argument('--incremental', action='store_true',
+                    help='assign new articles to the clusters in --model-file instead of refitting')
+parser.add_argument('--drift-threshold', type=float, default=0.2,
+                    help='refit once this fraction of the corpus was assigned with low confidence')
+parser.add_argument('--theme-concurrency', type=int, default=8,
+                    help='number of cluster themes requested at once')
+parser.add_argument('--theme-cache', default=None,
+                    help='json file caching themes by cluster membership')
+parser.add_argument('--visualize', default='none', choices=visualize.MODES,
+                    help='plot the clusters with t-SNE, fast reduces with pca and samples first')
+parser.add_argument('--plot-file', default=None, help='save the plot here instead of showing it')
+parser.add_argument('--viz-sample', type=int, default=2000,
+                    help='maximum number of points plotted in fast mode')
+args = parser.parse_args()
+
+datafile_path = args.datafile_path
+out_file = args.out_file
+
+# load data, the matrix is memory mapped and only read in by the clustering
+df, matrix = vectorstore.load(datafile_path)
+# one row per link
+duplicated = df.link.duplicated().values
+if duplicated.any():
+    df = df[~duplicated].reset_index(drop=True)
+    matrix = matrix[~duplicated]
+
+print(df.head())
 
 print("shape of matrix:", matrix.shape)
 print("df.shape:", df.shape)
-n_clusters = max(df.shape[0] // 6, 4)
+
+state = None
+labels = None
+if args.incremental:
+    state = incremental.load_state(args.model_file)
+    if state is not None and not incremental.matches(state, args):
+        print("Model file was fitted with different settings, refitting")
+        state = None
+    if state is not None:
+        labels, refit_reason = incremental.assign(state, df.link.values, matrix, args.drift_threshold, args.threads)
+        if refit_reason:
+            print(f"Refitting: {refit_reason}")
+            state = None
+            labels = None
+
+if state is not None:
+    n_clusters = state['n_clusters']
+else:
+    n_clusters = min(max(df.shape[0] // 6, 4), df.shape[0])
 print("n_clusters:", n_clusters)
 
 #kmeans = KMeans(n_clusters=n_clusters, init="random", n_init=1000)
@@ -52,50 +157,48 @@ print("n_clusters:", n_clusters)
 #labels = agglo.labels_
 #df["Cluster"] = labels
 
-gmm = GaussianMixture(n_components=n_clusters)
-gmm.fit(matrix)
-labels = gmm.predict(matrix)
+theme_cache = themecache.ThemeCache(args.theme_cache)
+if state is not None:
+    # the themes of the saved model are valid for clusters that still have the same members
+    members = incremental.cluster_members(state['assignments'])
+    for cluster, theme in state['themes'].items():
+        if cluster in members:
+            theme_cache.seed(members[cluster], theme)
+else:
+    print(f"engine: {args.engine}, reducer: {args.reducer} ({args.reduce_dim} dims)")
+    labels, reducer, model = engines.fit(
+        matrix,
+        n_clusters,
+        engine=args.engine,
+        reducer=args.reducer,
+        reduce_dim=args.reduce_dim,
+        threads=args.threads,
+    )
+    state = incremental.make_state(args, n_clusters, reducer, model, matrix, df.link.values, labels)
 df["Cluster"] = labels
 
 
 
 #df.groupby("Cluster").Score.mean().sort_values()
 
-from sklearn.manifold import TSNE
-import matplotlib
-import matplotlib.pyplot as plt
-
-tsne = TSNE(n_components=2, perplexity=min(n_clusters-1,15), init="random", learning_rate=200)
-vis_dims2 = tsne.fit_transform(matrix)
-
-x = [x for x, y in vis_dims2]
-y = [y for x, y in vis_dims2]
-
-for category, color in enumerate(["purple", "green", "red", "blue"]):
-    xs = np.array(x)[df.Cluster == category]
-    ys = np.array(y)[df.Cluster == category]
-    plt.scatter(xs, ys, color=color, alpha=0.3)
-
-    avg_x = xs.mean()
-    avg_y = ys.mean()
-
-    plt.scatter(avg_x, avg_y, marker="x", color=color, s=100)
-plt.title("Clusters identified visualized in language 2d using t-SNE")
-
-#plt.show()
+visualize.plot_clusters(matrix, labels, n_clusters, args.visualize, args.plot_file, args.viz_sample)
 
 
 # Reading a review which belong to each group.
 total_posts = 0
 rev_per_cluster = 5
 
-for i in range(n_clusters):
-    cluster_posts = []
-    cluster_theme = ""
-
-    print(f"Cluster {i} Theme:", end=" ")
-
-    posts = "\n\n\n".join(
+cluster_ids = [i for i in range(n_clusters) if (df.Cluster == i).any()]
+
+themes = {}
+uncached_posts = {}
+for i in cluster_ids:
+    cluster_links = df[df.Cluster == i].link.values
+    theme = theme_cache.get(cluster_links)
+    if theme is not None:
+        themes[i] = theme
+        continue
+    uncached_posts[i] = "\n\n\n".join(
         df[df.Cluster == i]
         .combined.str.replace("Title: ", "")
         .str.replace("\n\nContent: ", ":  ")
@@ -103,34 +206,17 @@ for i in range(n_clusters):
         .values
     )
 
-    num_tries = 4
-    sleep_time = 1.4
-    response = None
-    while response is None and num_tries > 0:
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo-16k",
-                messages=[
-                    {
-                        "role":"user",
-                        "content":f'What do the following posts have in common. Provide one short sentence capturing the common theme of the posts.\n\nPosts:\n"""\n{posts}\n"""\n\nTheme:'
-                    }
-                ],
-                temperature=0,
-                max_tokens=64,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0,
-            )
-            cluster_theme = response["choices"][0]["message"]["content"]
-            print(cluster_theme)
-        except Exception as e:
-            if num_tries == 0:
-                raise e
-            num_tries -= 1
-            print(f"Error: {e}. Sleeping for {sleep_time} seconds.")
-            time.sleep(sleep_time)
-            sleep_time *= 2
+print(f"{len(themes)} cluster themes cached, requesting {len(uncached_posts)}")
+new_themes = get_cluster_themes(uncached_posts, args.theme_concurrency)
+for i, theme in new_themes.items():
+    theme_cache.set(df[df.Cluster == i].link.values, theme)
+themes.update(new_themes)
+
+for i in cluster_ids:
+    cluster_posts = []
+    cluster_theme = themes[i]
+
+    print(f"Cluster {i} Theme: {cluster_theme}")
 
     #sample_cluster_rows = df[df.Cluster == i].sample(rev_per_cluster, random_state=42)
     sample_cluster_rows = df[df.Cluster == i]
@@ -153,8 +239,18 @@ for i in range(n_clusters):
 
     print("-" * 100)
 
+theme_cache.save()
 print(f"Total posts: {total_posts}")
 
+if args.export_csv:
+    vectorstore.export_csv(args.export_csv, df, matrix)
+
 with open(out_file, "w") as f:
     json.dump(clustered_posts, f)
 
+if args.model_file:
+    state['assignments'] = {link: int(label) for link, label in zip(df.link.values, df.Cluster.values)}
+    state['themes'] = themes
+    incremental.save_state(args.model_file, state)
+    print(f"Saved model to {args.model_file}")
+
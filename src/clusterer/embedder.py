@@ -0,0 +1,128 @@
+import json
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# the api accepts at most 2048 inputs per request, and caps the total tokens
+# in a single request, so we stay well below both
+DEFAULT_MAX_BATCH_TOKENS = 100000
+DEFAULT_MAX_BATCH_SIZE = 512
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+
+
+class OpenAIBackend:
+    # the pre 1.0 openai api, the same one cluster.py uses
+    def __init__(self, model, base_url=None):
+        self.model = model
+        self.base_url = base_url
+
+    def embed(self, texts):
+        import openai
+        kwargs = {'api_base': self.base_url} if self.base_url else {}
+        response = openai.Embedding.create(input=texts, model=self.model, **kwargs)
+        # the api does not promise to return the data in input order
+        return [d['embedding'] for d in sorted(response['data'], key=lambda d: d['index'])]
+
+
+class HttpBackend:
+    """
+    Talks to any server exposing an OpenAI compatible /v1/embeddings endpoint,
+    such as fake_embedding_server.py.
+    """
+
+    def __init__(self, model, url, timeout=60):
+        self.model = model
+        self.url = url.rstrip('/') + '/v1/embeddings'
+        self.timeout = timeout
+
+    def embed(self, texts):
+        body = json.dumps({'input': texts, 'model': self.model}).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=self.timeout) as res:
+            response = json.loads(res.read().decode('utf-8'))
+        return [d['embedding'] for d in sorted(response['data'], key=lambda d: d['index'])]
+
+
+def make_backend(name, model, url=None):
+    if name == 'openai':
+        return OpenAIBackend(model, base_url=url)
+    elif name == 'http':
+        if url is None:
+            raise ValueError("The http embedding backend needs a url")
+        return HttpBackend(model, url)
+    else:
+        raise ValueError(f"Unknown embedding backend: {name}")
+
+
+def pack_batches(n_tokens, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """
+    Greedily pack consecutive texts into batches of input indexes, so that no
+    batch goes over the token budget or the maximum number of inputs.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, tokens in enumerate(n_tokens):
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def embed_batch(backend, texts, max_retries=DEFAULT_MAX_RETRIES, sleep_time=1.0):
+    num_tries = 0
+    while True:
+        try:
+            embeddings = backend.embed(texts)
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+            return embeddings
+        except Exception as e:
+            num_tries += 1
+            if num_tries > max_retries:
+                raise e
+            # jitter so that concurrent batches do not all retry at once
+            delay = sleep_time * (1 + random.random() * 0.5)
+            print(f"Error: {e}. Sleeping for {delay:.1f} seconds.")
+            time.sleep(delay)
+            sleep_time *= 2
+
+
+def embed_texts(texts, n_tokens, backend,
+                max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+                max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                concurrency=DEFAULT_CONCURRENCY,
+                max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Embed all the texts, sending up to `concurrency` batches at a time.
+    The returned embeddings are in the same order as the input texts.
+    """
+    texts = list(texts)
+    batches = pack_batches(n_tokens, max_batch_tokens, max_batch_size)
+    print(f"Embedding {len(texts)} texts in {len(batches)} batches, concurrency {concurrency}")
+
+    results = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        futures = {
+            pool.submit(embed_batch, backend, [texts[i] for i in batch], max_retries): batch
+            for batch in batches
+        }
+        try:
+            for future in as_completed(futures):
+                batch = futures[future]
+                for i, embedding in zip(batch, future.result()):
+                    results[i] = embedding
+        except Exception:
+            # don't keep sending batches after one has run out of retries
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
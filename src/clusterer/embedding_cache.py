@@ -0,0 +1,79 @@
+import hashlib
+import time
+
+import numpy as np
+
+from redislru import RedisLru
+
+DEFAULT_TTL = 60 * 60 * 24 * 30  # 30 days
+DEFAULT_MAX_ENTRIES = 200000
+CHUNK_SIZE = 500
+
+
+class EmbeddingCache:
+    """
+    Content addressed embedding cache in redis.
+
+    Vectors are stored as raw float32 blobs under
+    `embedding:<model>:<sha256 of text>`, expired and evicted by RedisLru.
+    """
+
+    def __init__(self, client, model, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, prefix='embedding'):
+        self.client = client
+        self.model = model
+        self.prefix = f"{prefix}:{model}"
+        self.lru = RedisLru(client, f"{self.prefix}:lru", ttl, max_entries)
+        self.stats_key = f"{self.prefix}:stats"
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        return f"{self.prefix}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, texts):
+        """
+        Returns a list with a float32 vector for every cached text, and None
+        for the texts that still need to be embedded.
+        """
+        keys = [self.key(text) for text in texts]
+        results = []
+        now = time.time()
+        for start in range(0, len(keys), CHUNK_SIZE):
+            chunk = keys[start:start + CHUNK_SIZE]
+            blobs = self.client.mget(chunk)
+            pipe = self.client.pipeline(transaction=False)
+            for key, blob in zip(chunk, blobs):
+                if blob is None:
+                    results.append(None)
+                    continue
+                results.append(np.frombuffer(blob, dtype=np.float32))
+                self.lru.touch(pipe, key, now)
+            pipe.execute()
+
+        hits = sum(1 for r in results if r is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def set_many(self, texts, embeddings):
+        now = time.time()
+        items = list(zip(texts, embeddings))
+        for start in range(0, len(items), CHUNK_SIZE):
+            pipe = self.client.pipeline(transaction=False)
+            for text, embedding in items[start:start + CHUNK_SIZE]:
+                self.lru.add(pipe, self.key(text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            pipe.execute()
+        self.evict()
+
+    def evict(self):
+        return self.lru.evict()
+
+    def report(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0
+        # keep a running total across runs as well
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hincrby(self.stats_key, 'hits', self.hits)
+        pipe.hincrby(self.stats_key, 'misses', self.misses)
+        pipe.execute()
+        print(f"Embedding cache: {self.hits} hits, {self.misses} misses ({ratio:.1%} hit ratio)")
@@ -1,33 +1,39 @@
 # imports
 import pprint
+import numpy as np
 import pandas as pd
 import tiktoken
 import redis
 import json
 import os
 import sys
+import argparse
 
+import annindex
+import embedder
+import vectorstore
+from embedding_cache import EmbeddingCache, DEFAULT_TTL, DEFAULT_MAX_ENTRIES
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
-def get_embedding(text, model="text-embedding-ada-002"): # model = "deployment_name"
-    return client.embeddings.create(input = [text], model=model).data[0].embedding
-
-def search_docs(df, user_query, top_n=4, to_print=True):
-    embedding = get_embedding(
-        user_query,
-        model="text-embedding-ada-002" # model should be set to the deployment name you chose when you deployed the text-embedding-ada-002 (Version 2) model
-    )
-    df["similarities"] = df.ada_v2.apply(lambda x: cosine_similarity(x, embedding))
-
-    res = (
-        df.sort_values("similarities", ascending=False)
-        .head(top_n)
-    )
-    if to_print:
-        display(res)
-    return res
+def load_articles(client, article_ids, chunk_size=500, missing=None):
+    """
+    Yields (article, summary) for every article id that has both an article
+    and a summary in redis. The keys are fetched with one MGET per chunk, and
+    only one chunk of raw payloads is held at a time.
+    """
+    for start in range(0, len(article_ids), chunk_size):
+        chunk = article_ids[start:start + chunk_size]
+        article_keys = ["article:" + x for x in chunk]
+        summary_keys = ["summary:" + key for key in article_keys]
+        values = client.mget(article_keys + summary_keys)
+        for i, key in enumerate(article_keys):
+            articlestr = values[i]
+            summarystr = values[len(chunk) + i]
+            if articlestr is None or summarystr is None:
+                if missing is not None:
+                    missing['article' if articlestr is None else 'summary'] += 1
+                continue
+            yield json.loads(articlestr), json.loads(summarystr)
 
 
 
@@ -41,52 +47,60 @@ client = redis.from_url(redis_host)
 
 
 
-articles_file = sys.argv[1]
+parser = argparse.ArgumentParser(description='Embed article summaries')
+parser.add_argument('articles_file')
+parser.add_argument('out_file')
+parser.add_argument('--backend', default='openai', choices=['openai', 'http'],
+                    help='embedding backend, use http with fake_embedding_server.py for testing')
+parser.add_argument('--backend-url', default=None, help='base url of the embedding server')
+parser.add_argument('--concurrency', type=int, default=embedder.DEFAULT_CONCURRENCY,
+                    help='number of embedding requests in flight at once')
+parser.add_argument('--batch-tokens', type=int, default=embedder.DEFAULT_MAX_BATCH_TOKENS,
+                    help='maximum number of tokens sent in a single embedding request')
+parser.add_argument('--batch-size', type=int, default=embedder.DEFAULT_MAX_BATCH_SIZE,
+                    help='maximum number of texts sent in a single embedding request')
+parser.add_argument('--csv', action='store_true',
+                    help='also export the embeddings in the old csv format, next to the binary files')
+parser.add_argument('--no-cache', action='store_true', help='do not use the redis embedding cache')
+parser.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL,
+                    help='seconds a cached embedding is kept after it was last used')
+parser.add_argument('--cache-max-entries', type=int, default=DEFAULT_MAX_ENTRIES,
+                    help='least recently used embeddings are evicted above this many entries')
+parser.add_argument('--chunk-size', type=int, default=500,
+                    help='number of articles fetched from redis per round trip')
+parser.add_argument('--ann-index', default=None,
+                    help='directory of the related articles index to add the new vectors to')
+args = parser.parse_args()
+
+articles_file = args.articles_file
 if not os.path.exists(articles_file):
     print(f"Articles file {articles_file} does not exist")
     sys.exit(1)
-if articles_file is None:
-    print("Usage: python embeddings.py <articles_file> <out_file>")
-    sys.exit(1)
 article_ids = open(articles_file).readlines()
 article_ids = [x.strip() for x in article_ids]
 if len(article_ids) == 0:
     print(f"WARN: No articles found in file {articles_file}")
     sys.exit(0)
 
-out_file = sys.argv[2]
-if out_file is None:
-    print("Usage: python embeddings.py <articles_file> <out_file>")
-    sys.exit(1)
-
-article_keys = ["article:" + x for x in article_ids]
-summary_keys = ["summary:" + x for x in article_ids]
+out_file = args.out_file
 
 titles = []
 summaries = []
 links = []
 tags = []
 
-for key in article_keys:
-    articlestr = client.get(key)
-    article = json.loads(articlestr.decode('utf-8'))
+missing_keys = {'article': 0, 'summary': 0}
+for article, summary in load_articles(client, article_ids, args.chunk_size, missing_keys):
     print(article['link'])
-    summary_key = "summary:" + key
-    summarystr = client.get(summary_key)
-    if summarystr is None:
-        continue
-    summary = json.loads(summarystr.decode('utf-8'))
-    #pprint.pprint(summary)
-
     titles.append(article['title'])
     links.append(article['link'])
     summaries.append(summary['summary'])
-    tags_str = ' '.join(['#' + tag['tag'] for tag in summary['tags']])
+    tags_str = ' '.join(['#' + tag['tag'] for tag in summary.get('tags', [])])
     tags.append(tags_str)
 
-print(f"Found {len(titles)} articles")
-print(f"Found {len(summaries)} summaries")
-print(f"Found {len(article_keys)} article keys")
+print(f"Found {len(titles)} articles with summaries")
+print(f"Missing {missing_keys['article']} articles, {missing_keys['summary']} summaries")
+print(f"Found {len(article_ids)} article keys")
 
 # embedding model parameters
 embedding_model = "text-embedding-ada-002"
@@ -113,9 +127,47 @@ print(len(df))
 
 # Ensure you have your API key set in your environment per the README: https://github.com/openai/openai-python#usage
 
-# This may take a few minutes
-df["embedding"] = df.combined.apply(lambda x: get_embedding(x, embedding_model))
-df.to_csv(out_file)
+cache = None
+if args.no_cache:
+    embeddings = [None] * len(df)
+else:
+    cache = EmbeddingCache(client, embedding_model, ttl=args.cache_ttl, max_entries=args.cache_max_entries)
+    embeddings = cache.get_many(df.combined.values)
+
+# only new or changed summaries go to the embedding api
+missing = [i for i, e in enumerate(embeddings) if e is None]
+if missing:
+    backend = embedder.make_backend(args.backend, embedding_model, args.backend_url)
+    missing_texts = [df.combined.values[i] for i in missing]
+    new_embeddings = embedder.embed_texts(
+        missing_texts,
+        [df.n_tokens.values[i] for i in missing],
+        backend,
+        max_batch_tokens=args.batch_tokens,
+        max_batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    if cache is not None:
+        cache.set_many(missing_texts, new_embeddings)
+    for i, embedding in zip(missing, new_embeddings):
+        embeddings[i] = embedding
+
+if embeddings:
+    matrix = np.vstack([np.asarray(e, dtype=np.float32) for e in embeddings])
+else:
+    matrix = np.empty((0, 0), dtype=np.float32)
+meta = df[vectorstore.META_COLUMNS]
+vectorstore.save(out_file, meta, matrix)
+print(f"Wrote {matrix.shape} vectors to {vectorstore.vectors_path(out_file)}")
+if args.csv:
+    vectorstore.export_csv(vectorstore.base_path(out_file) + '.csv', meta, matrix)
+
+if args.ann_index and len(meta):
+    index = annindex.update_index(args.ann_index, matrix, meta.link.tolist())
+    print(f"Ann index at {args.ann_index} has {len(index)} vectors")
+
+if cache is not None:
+    cache.report()
 
 
 
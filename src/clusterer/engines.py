@@ -0,0 +1,87 @@
+import contextlib
+
+import numpy as np
+
+ENGINES = ['minibatch-kmeans', 'kmeans', 'gmm-diag', 'gmm']
+REDUCERS = ['pca', 'svd', 'none']
+
+DEFAULT_ENGINE = 'minibatch-kmeans'
+DEFAULT_REDUCER = 'pca'
+DEFAULT_REDUCE_DIM = 64
+
+
+def make_reducer(name, dim, n_samples, n_features, random_state=0):
+    if name == 'none':
+        return None
+    # pca can't produce more components than samples or features
+    dim = min(dim, n_features, max(n_samples - 1, 1))
+    if name == 'pca':
+        from sklearn.decomposition import PCA
+        return PCA(n_components=dim, random_state=random_state)
+    elif name == 'svd':
+        from sklearn.decomposition import TruncatedSVD
+        return TruncatedSVD(n_components=dim, random_state=random_state)
+    else:
+        raise ValueError(f"Unknown reducer: {name}")
+
+
+def make_engine(name, n_clusters, random_state=0):
+    if name == 'minibatch-kmeans':
+        from sklearn.cluster import MiniBatchKMeans
+        return MiniBatchKMeans(n_clusters=n_clusters, n_init=3, batch_size=1024, random_state=random_state)
+    elif name == 'kmeans':
+        from sklearn.cluster import KMeans
+        return KMeans(n_clusters=n_clusters, n_init=3, random_state=random_state)
+    elif name == 'gmm-diag':
+        from sklearn.mixture import GaussianMixture
+        return GaussianMixture(n_components=n_clusters, covariance_type='diag', random_state=random_state)
+    elif name == 'gmm':
+        # the original engine, full covariance
+        from sklearn.mixture import GaussianMixture
+        return GaussianMixture(n_components=n_clusters, random_state=random_state)
+    else:
+        raise ValueError(f"Unknown clustering engine: {name}")
+
+
+def limit_threads(threads):
+    """
+    Pin the BLAS/OpenMP thread pools used by numpy and sklearn to `threads`.
+    """
+    if not threads:
+        return contextlib.nullcontext()
+    from threadpoolctl import threadpool_limits
+    return threadpool_limits(limits=threads)
+
+
+def fit(matrix, n_clusters, engine=DEFAULT_ENGINE, reducer=DEFAULT_REDUCER,
+        reduce_dim=DEFAULT_REDUCE_DIM, threads=None, random_state=0):
+    """
+    Reduce the embeddings and fit the clustering engine on them.
+    Returns (labels, reducer, model); reducer is None when not reducing.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    with limit_threads(threads):
+        reducer_model = make_reducer(reducer, reduce_dim, matrix.shape[0], matrix.shape[1], random_state)
+        reduced = reducer_model.fit_transform(matrix) if reducer_model is not None else matrix
+        model = make_engine(engine, n_clusters, random_state)
+        model.fit(reduced)
+        labels = model.predict(reduced)
+    return labels, reducer_model, model
+
+
+def predict(matrix, reducer, model, threads=None):
+    """
+    Assign vectors to the clusters of an already fitted model.
+    Returns (labels, scores), where a higher score means a more confident
+    assignment: the posterior probability for mixtures, and the negative
+    distance to the centroid for kmeans.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    with limit_threads(threads):
+        reduced = reducer.transform(matrix) if reducer is not None else matrix
+        labels = model.predict(reduced)
+        if hasattr(model, 'predict_proba'):
+            scores = model.predict_proba(reduced).max(axis=1)
+        else:
+            scores = -model.transform(reduced).min(axis=1)
+    return labels, scores
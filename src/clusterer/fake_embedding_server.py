@@ -0,0 +1,87 @@
+# A local stand-in for the OpenAI embeddings endpoint, for tests and benchmarks.
+#
+#   python fake_embedding_server.py --port 8089 --latency 0.2
+#   python embeddings.py articles.keys out.csv --backend http --backend-url http://localhost:8089
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_embedding(text, dim):
+    # deterministic for a given text, so repeated runs are comparable
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def make_handler(dim, latency, stats):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/v1/embeddings':
+                self.send_error(404)
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+            texts = body['input']
+            if isinstance(texts, str):
+                texts = [texts]
+
+            with stats['lock']:
+                stats['requests'] += 1
+                stats['inputs'] += len(texts)
+
+            # a fixed per request cost, like a real network round trip
+            time.sleep(latency)
+
+            response = {
+                'object': 'list',
+                'model': body.get('model'),
+                'data': [
+                    {'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, dim)}
+                    for i, text in enumerate(texts)
+                ],
+            }
+            payload = json.dumps(response).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(port=0, dim=1536, latency=0.0):
+    """
+    Start the server on a background thread. Returns the server, its url and
+    a dict counting the requests and inputs it has handled.
+    """
+    stats = {'requests': 0, 'inputs': 0, 'lock': threading.Lock()}
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(dim, latency, stats))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    return server, url, stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake OpenAI compatible embedding server')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait per request')
+    args = parser.parse_args()
+
+    stats = {'requests': 0, 'inputs': 0, 'lock': threading.Lock()}
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), make_handler(args.dim, args.latency, stats))
+    print(f"Fake embedding server listening on port {args.port}")
+    server.serve_forever()
@@ -0,0 +1,95 @@
+# Saved clustering state for cluster.py --incremental.
+#
+# The fitted reducer and model are kept together with the cluster of every
+# link and the theme of every cluster. New links are assigned to the nearest
+# existing cluster, and a full refit is only needed once too many of them fit
+# their cluster badly.
+import os
+
+import joblib
+import numpy as np
+
+import engines
+
+STATE_VERSION = 1
+# new vectors scoring below this quantile of the training scores are
+# counted as low confidence assignments
+OUTLIER_QUANTILE = 0.05
+# a posterior of at least this is always a confident assignment
+MIN_PROBABILITY = 0.5
+
+
+def make_state(args, n_clusters, reducer, model, matrix, links, labels):
+    _, scores = engines.predict(matrix, reducer, model, args.threads)
+    threshold = float(np.quantile(scores, OUTLIER_QUANTILE))
+    if hasattr(model, 'predict_proba'):
+        threshold = min(threshold, MIN_PROBABILITY)
+    return {
+        'version': STATE_VERSION,
+        'engine': args.engine,
+        'reducer_name': args.reducer,
+        'reduce_dim': args.reduce_dim,
+        'n_clusters': n_clusters,
+        'reducer': reducer,
+        'model': model,
+        'threshold': threshold,
+        'assignments': {link: int(label) for link, label in zip(links, labels)},
+        'themes': {},
+        'low_confidence': 0,
+    }
+
+
+def load_state(path):
+    if not path or not os.path.exists(path):
+        return None
+    state = joblib.load(path)
+    if state.get('version') != STATE_VERSION:
+        print(f"Ignoring model file {path} with version {state.get('version')}")
+        return None
+    return state
+
+
+def save_state(path, state):
+    joblib.dump(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def matches(state, args):
+    return (state['engine'], state['reducer_name'], state['reduce_dim']) == (args.engine, args.reducer, args.reduce_dim)
+
+
+def cluster_members(assignments):
+    members = {}
+    for link, label in assignments.items():
+        members.setdefault(label, []).append(link)
+    return {label: sorted(links) for label, links in members.items()}
+
+
+def assign(state, links, matrix, drift_threshold, threads=None):
+    """
+    Label every link, keeping the cluster of links seen before and assigning
+    new links to the nearest cluster. Returns (labels, refit_reason), where
+    refit_reason is None unless the low confidence assignments since the last
+    full fit went over `drift_threshold` of the corpus.
+    """
+    known = state['assignments']
+    labels = np.empty(len(links), dtype=int)
+    new = []
+    for i, link in enumerate(links):
+        if link in known:
+            labels[i] = known[link]
+        else:
+            new.append(i)
+
+    print(f"Incremental: {len(links) - len(new)} known links, {len(new)} new links")
+    if new:
+        new_labels, scores = engines.predict(matrix[new], state['reducer'], state['model'], threads)
+        labels[new] = new_labels
+        low = int((scores < state['threshold']).sum())
+        state['low_confidence'] += low
+        print(f"Incremental: {low} low confidence assignments")
+
+    drift = state['low_confidence'] / max(len(links), 1)
+    if drift > drift_threshold:
+        return labels, f"{drift:.1%} low confidence assignments since the last fit"
+    return labels, None
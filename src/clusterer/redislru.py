@@ -0,0 +1,47 @@
+# Kept identical in src/clusterer and src/summarise: each runs from its own
+# directory (see runPython in src/crawler/python.js), so neither can import
+# the other's copy. Change both.
+import time
+
+
+class RedisLru:
+    """
+    Sliding expiry and least recently used eviction for cache entries in
+    redis. Every entry expires after `ttl` seconds without being read, and
+    when there are more than `max_entries` the least recently used are
+    evicted, using a sorted set of access times at `lru_key`.
+    """
+
+    def __init__(self, client, lru_key, ttl, max_entries):
+        self.client = client
+        self.lru_key = lru_key
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def add(self, pipe, key, value, now=None):
+        pipe.set(key, value, ex=self.ttl)
+        pipe.zadd(self.lru_key, {key: now or time.time()})
+
+    def touch(self, pipe, key, now=None):
+        # sliding expiry, and mark as recently used
+        pipe.expire(key, self.ttl)
+        pipe.zadd(self.lru_key, {key: now or time.time()})
+
+    def evict(self):
+        """
+        Drops the least recently used entries over `max_entries`, returns
+        how many.
+        """
+        # drop lru entries whose key already expired
+        self.client.zremrangebyscore(self.lru_key, '-inf', time.time() - self.ttl)
+        if not self.max_entries:
+            return 0
+        overflow = self.client.zcard(self.lru_key) - self.max_entries
+        if overflow <= 0:
+            return 0
+        oldest = self.client.zrange(self.lru_key, 0, overflow - 1)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(*oldest)
+        pipe.zrem(self.lru_key, *oldest)
+        pipe.execute()
+        return len(oldest)
@@ -0,0 +1,45 @@
+# Cluster themes cached by a hash of the cluster's sorted member links, so a
+# cluster whose membership did not change is never sent to the LLM again.
+import hashlib
+import json
+import os
+import time
+
+# entries not used for this long are dropped when saving
+MAX_AGE = 60 * 60 * 24 * 14
+
+
+def membership_key(links):
+    return hashlib.sha256("\n".join(sorted(links)).encode('utf-8')).hexdigest()
+
+
+class ThemeCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, links):
+        entry = self.entries.get(membership_key(links))
+        if entry is None:
+            return None
+        entry['used'] = time.time()
+        return entry['theme']
+
+    def set(self, links, theme):
+        self.entries[membership_key(links)] = {'theme': theme, 'used': time.time()}
+
+    def seed(self, links, theme):
+        # don't overwrite a theme we already know for these links
+        self.entries.setdefault(membership_key(links), {'theme': theme, 'used': time.time()})
+
+    def save(self):
+        if not self.path:
+            return
+        oldest = time.time() - MAX_AGE
+        entries = {key: entry for key, entry in self.entries.items() if entry['used'] >= oldest}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(entries, f)
+        os.replace(self.path + '.tmp', self.path)
@@ -0,0 +1,72 @@
+# On disk format shared by embeddings.py and cluster.py.
+#
+#   <base>.npy        float32 matrix, one row per article, memory mappable
+#   <base>.meta.json  one json record per row (title, summary, link, tags, combined)
+#
+# <base> is the output path given to embeddings.py without its extension, so
+# `out.csv`, `out.npy` and `out` all refer to the same files.
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+VECTORS_SUFFIX = '.npy'
+META_SUFFIX = '.meta.json'
+META_COLUMNS = ['title', 'summary', 'link', 'tags', 'combined']
+
+
+def base_path(path):
+    for suffix in [META_SUFFIX, VECTORS_SUFFIX, '.csv']:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def vectors_path(path):
+    return base_path(path) + VECTORS_SUFFIX
+
+
+def meta_path(path):
+    return base_path(path) + META_SUFFIX
+
+
+def save(path, meta, matrix):
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] != len(meta):
+        raise ValueError(f"Expected {len(meta)} vectors, got a matrix of shape {matrix.shape}")
+
+    # write to temporary files first so a reader never sees half a file
+    vectors_file = vectors_path(path)
+    meta_file = meta_path(path)
+    np.save(vectors_file + '.tmp.npy', matrix)
+    meta.reset_index(drop=True).to_json(meta_file + '.tmp', orient='records', lines=True)
+    os.replace(vectors_file + '.tmp.npy', vectors_file)
+    os.replace(meta_file + '.tmp', meta_file)
+
+
+def load(path, mmap=True):
+    """
+    Returns (meta dataframe, float32 matrix). The matrix is memory mapped
+    read only unless mmap is False.
+
+    Falls back to the old CSV format, with the embedding stored as a
+    stringified list in the `embedding` column, when there is no binary file.
+    """
+    vectors_file = vectors_path(path)
+    if os.path.exists(vectors_file):
+        matrix = np.load(vectors_file, mmap_mode='r' if mmap else None)
+        meta = pd.read_json(meta_path(path), orient='records', lines=True, dtype=False)
+        return meta, matrix
+
+    df = pd.read_csv(path)
+    # the lists are written by python's repr of floats, which is valid json
+    matrix = np.vstack(df.embedding.apply(json.loads).values).astype(np.float32)
+    meta = df.drop(columns=['embedding'])
+    return meta, matrix
+
+
+def export_csv(path, meta, matrix):
+    df = meta.copy()
+    df['embedding'] = [json.dumps(row.tolist()) for row in np.asarray(matrix)]
+    df.to_csv(path)
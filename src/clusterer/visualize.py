@@ -0,0 +1,60 @@
+# Optional 2d plot of the clusters. Nothing in the production path needs it,
+# so sklearn.manifold and matplotlib are only imported when plotting.
+import numpy as np
+
+MODES = ['none', 'tsne', 'fast']
+# dimensions kept by pca before running t-SNE in fast mode
+FAST_PCA_DIM = 50
+
+
+def embed_2d(matrix, n_clusters, mode, sample=None, random_state=0):
+    """
+    Returns (row indexes, 2d points) for the rows that were plotted. In fast
+    mode the embeddings are first reduced with pca and t-SNE only runs on a
+    random sample of at most `sample` rows.
+    """
+    from sklearn.manifold import TSNE
+
+    rows = np.arange(matrix.shape[0])
+    if mode == 'fast' and sample and matrix.shape[0] > sample:
+        rng = np.random.default_rng(random_state)
+        rows = np.sort(rng.choice(matrix.shape[0], sample, replace=False))
+    data = np.asarray(matrix[rows], dtype=np.float32)
+
+    if mode == 'fast' and data.shape[1] > FAST_PCA_DIM:
+        from sklearn.decomposition import PCA
+        dim = min(FAST_PCA_DIM, max(data.shape[0] - 1, 1))
+        data = PCA(n_components=dim, random_state=random_state).fit_transform(data)
+
+    perplexity = max(min(n_clusters - 1, 15, data.shape[0] - 1), 1)
+    tsne = TSNE(n_components=2, perplexity=perplexity, init="random", learning_rate=200, random_state=random_state)
+    return rows, tsne.fit_transform(data)
+
+
+def plot_clusters(matrix, labels, n_clusters, mode, out_file=None, sample=None):
+    if mode == 'none':
+        return
+
+    import matplotlib
+    if out_file:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    rows, vis_dims2 = embed_2d(matrix, n_clusters, mode, sample)
+    labels = np.asarray(labels)[rows]
+
+    for category, color in enumerate(["purple", "green", "red", "blue"]):
+        points = vis_dims2[labels == category]
+        if len(points) == 0:
+            continue
+        plt.scatter(points[:, 0], points[:, 1], color=color, alpha=0.3)
+
+        avg_x, avg_y = points.mean(axis=0)
+        plt.scatter(avg_x, avg_y, marker="x", color=color, s=100)
+    plt.title("Clusters identified visualized in language 2d using t-SNE")
+
+    if out_file:
+        plt.savefig(out_file)
+        print(f"Saved cluster plot to {out_file}")
+    else:
+        plt.show()
@@ -7,6 +7,10 @@ const pandoc = require('./pandoc.js');
 const createLogger = require('./logger');
 const logger = createLogger(module);
 
+const CRAWLED_STREAM = 'stream:crawled';
+// the page json is kept in redis until the summarisers had time to read it
+const PAGE_TTL = 7 * 24 * 60 * 60;
+
 class Crawler {
   constructor(url) {
     this.url = url;
@@ -273,6 +277,7 @@ class RedisCrawler {
 
   getCrawlKey(url) { return `crawler:${url}`; }
   getScreenshotKey(url) { return `screenshot:${url}`; }
+  getPageKey(url) { return `page:${url}`; }
 
   async savePage(page, url) {
     const screenshotBinaryContents = page.screenshot;
@@ -292,10 +297,13 @@ class RedisCrawler {
   }
 
   async publishCrawlResult(url) {
-    //const page = await this.getPage(url);
-    //const screenshotKey = this.getScreenshotKey(url);
-    //const screenshot = await this.client.get(screenshotKey);
-    //await this.client.publish('crawled', JSON.stringify({url, page, screenshot}));
+    // the summariser workers (src/summarise/worker.py) read the page json from
+    // redis, and its key from a stream so nothing is lost while they are busy
+    // or down
+    const page = await this.getPage(url);
+    const pageKey = this.getPageKey(url);
+    await this.client.set(pageKey, JSON.stringify(page), {EX: PAGE_TTL});
+    await this.client.xAdd(CRAWLED_STREAM, '*', {key: pageKey});
   }
 
 
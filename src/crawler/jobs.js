@@ -140,11 +140,19 @@ function setupworkers(db, client, opts) {
   });
 
   new Worker('clusterer', async (job) => {
-    const {inFileName, outPostsName} = job.data;
+    const {feed, inFileName, outPostsName} = job.data;
     logger.debug(`clustering ${inFileName} -> ${outPostsName}`);
     const relativeToRoot = path.join(__dirname, '..');
     const clustererDir = path.join(relativeToRoot, 'clusterer');
-    await python.runPython(clustererDir, 'cluster.py', [inFileName, outPostsName]);
+    // keep the fitted model per feed, so only new articles need to be clustered
+    const modelName = `cluster_${(feed ?? 'default').replace(/[^a-zA-Z0-9_-]/g, '_')}`;
+    const modelFile = path.resolve('./work', `${modelName}.joblib`);
+    const themeCache = path.resolve('./work', `${modelName}.themes.json`);
+    await python.runPython(clustererDir, 'cluster.py', [
+      inFileName, outPostsName,
+      '--incremental', '--model-file', modelFile,
+      '--theme-cache', themeCache,
+    ]);
   }, {
     ...opts,
   });
@@ -762,7 +762,7 @@ async function startSummariseFeeds(client, aifeed) {
   }
   const inFileName = os.tmpdir() + '/clustered_posts_' + (new Date()).getTime() + '.keys';
   fs.writeFileSync(inFileName, articles.join("\n"));
-  const outFileName = os.tmpdir() + '/clustered_posts_' + (new Date()).getTime() + '.csv';
+  const outFileName = os.tmpdir() + '/clustered_posts_' + (new Date()).getTime() + '.npy';
   const outPostsName = os.tmpdir() + '/clustered_posts_' + (new Date()).getTime() + '.json';
 
   const flow = await queues.flowProducer.add({
@@ -1,9 +1,12 @@
-from flask import Flask, render_template, request, Response
+from flask import Flask, render_template, request, Response, jsonify, redirect, url_for
 import werkzeug.exceptions
 from serverless_wsgi import handle_request
 import os
+import gzip
+import hashlib
 import logging
 import urllib
+from urllib.parse import urlsplit
 logging.basicConfig(level=logging.DEBUG)
 logging.getLogger('botocore').setLevel(logging.WARNING)
 logging.getLogger('boto3').setLevel(logging.WARNING)
@@ -12,19 +15,71 @@ logging.getLogger('werkzeug').setLevel(logging.WARNING)
 logging.getLogger('openai').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-import linkyai
+# only what every request needs is imported here, to keep lambda cold starts
+# short. search (numpy) is imported when SEARCH_INDEX_PATH is set, and the
+# summariser stack (langchain, bs4) by worker when a link is extracted
 import database
+import jobs
+import worker
 
 
-def make_app():
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+RSS_MAX_ITEMS = int(os.environ.get('RSS_MAX_ITEMS', 50))
+RSS_CACHE_SIZE = 64
+
+
+def make_database():
     database_type = os.environ.get('DATABASE_TYPE', 'memory')
     if database_type == 'dynamo':
-        db = database.DynamoDatabase()
+        return database.DynamoDatabase()
+    elif database_type == 'sqlite':
+        return database.SqliteDatabase(os.environ.get('DATABASE_PATH', 'linky.sqlite3'))
     elif database_type == 'memory':
-        db = database.InMemoryDatabase()
+        return database.InMemoryDatabase()
     else:
         # default
-        db = database.InMemoryDatabase()
+        return database.InMemoryDatabase()
+
+
+def make_search():
+    # semantic search is only enabled when there is somewhere to keep the index
+    search_index_path = os.environ.get('SEARCH_INDEX_PATH')
+    if not search_index_path:
+        return None, None
+    import atexit
+    import search
+    search_index = search.SearchIndex(search_index_path)
+    # links indexed in the last few seconds are only saved by a timer
+    atexit.register(search_index.save)
+    return search_index, search.Embedder()
+
+
+def index_link(search_index, embedder, url, data):
+    if search_index is None:
+        return
+    import search
+    item = {'url': url, 'title': data['title'], 'summary': data['summary']}
+    search_index.add([item], embedder.embed([search.item_text(item)]))
+    # appended together with any other links indexed meanwhile
+    search_index.save_soon()
+
+
+def make_app():
+    db = make_database()
+    search_index, embedder = make_search()
+
+    # rendered feeds by (limit, cursor), valid while the database is unchanged
+    rss_cache = {}
+
+    def on_saved(url, data):
+        rss_cache.clear()
+        index_link(search_index, embedder, url, data)
+
+    # with JOB_QUEUE=inline links are extracted during the request
+    queue = jobs.make_queue()
+    if queue is not None:
+        worker.start_worker_threads(queue, db, int(os.environ.get('JOB_WORKER_THREADS', 1)), on_saved)
 
     app = Flask(
         __name__,
@@ -32,52 +87,229 @@ def make_app():
         static_url_path='/',
         template_folder='templates'
     )
+    app.extensions['database'] = db
+
+    def wants_json():
+        return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+    def job_json(job):
+        return {
+            'id': job['id'],
+            'url': job['url'],
+            'status': job['status'],
+            'result': job['result'],
+            'error': job.get('error'),
+            'status_url': url_for('job_status', job_id=job['id'], _external=True),
+        }
+
+    def get_job(job_id):
+        job = queue.get(job_id) if queue is not None else None
+        if job is None:
+            raise werkzeug.exceptions.NotFound()
+        return job
 
     @app.route('/api/extract', methods=['POST'])
     def extract_info():
-        url = request.form.get('url')
+        url = request.form.get('url') or (request.get_json(silent=True) or {}).get('url')
+        if not url:
+            raise werkzeug.exceptions.BadRequest('No url given')
+        if urlsplit(url.strip()).scheme.lower() not in ('http', 'https'):
+            raise werkzeug.exceptions.BadRequest('Only http and https urls can be extracted')
+
+        # known links are answered from the database, without another summary
+        existing = db.find_url(url)
+        if existing is not None:
+            data = {'title': existing['title'], 'summary': existing['summary']}
+            if wants_json():
+                return jsonify({'url': existing['url'], 'status': jobs.DONE, 'result': data})
+            return render_template('extract.html', data=data)
+
+        if queue is None:
+            data = worker.extract_and_save(db, url, on_saved)
+            return render_template('extract.html', data=data)
 
-        data = linkyai.get_summary("http://localhost:8081?url=" + url)
-        logger.info(f"Extracted {data}")
+        job = queue.enqueue(url)
+        if wants_json():
+            return jsonify(job_json(job)), 202
+        return redirect(url_for('job_page', job_id=job['id']), 303)
 
-        db.save_url(url, data['title'], data['summary'])
+    @app.route('/api/import', methods=['POST'])
+    def bulk_import():
+        # a json {"urls": [...]}, an uploaded bookmarks export or url list, or
+        # the same as the request body
+        import bulk_import
+        if queue is None:
+            raise werkzeug.exceptions.BadRequest('Importing needs a job queue, or use python bulk_import.py')
 
-        return render_template('extract.html', data=data)
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            urls = body.get('urls', [])
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                raise werkzeug.exceptions.BadRequest('"urls" must be a list of strings')
+            urls = bulk_import.parse_urls('\n'.join(urls))
+        elif 'file' in request.files:
+            urls = bulk_import.parse_urls(request.files['file'].read().decode('utf-8', errors='replace'))
+        else:
+            urls = bulk_import.parse_urls(request.get_data(as_text=True))
+        if not urls:
+            raise werkzeug.exceptions.BadRequest('No urls given')
+        if len(urls) > bulk_import.MAX_IMPORT_URLS:
+            raise werkzeug.exceptions.BadRequest(f'At most {bulk_import.MAX_IMPORT_URLS} urls at a time')
+
+        # the workers skip links that are already saved
+        queued = [queue.enqueue(url) for url in urls]
+        return jsonify({'count': len(queued), 'jobs': [job_json(job) for job in queued]}), 202
+
+    @app.route('/api/jobs/<job_id>')
+    def job_status(job_id):
+        return jsonify(job_json(get_job(job_id)))
+
+    @app.route('/jobs/<job_id>')
+    def job_page(job_id):
+        job = get_job(job_id)
+        # htmx polls for just the status block until the job is finished
+        if request.headers.get('HX-Request'):
+            return render_template('partials/job_status.html', job=job)
+        return render_template('job.html', job=job)
+
+    @app.route('/api/search', methods=['GET', 'POST'])
+    def semantic_search():
+        if search_index is None:
+            return jsonify({'error': 'Search is not enabled, set SEARCH_INDEX_PATH'}), 404
+        import search
+
+        # GET ?q=... for one query, or POST {"queries": [...]} for a batch
+        if request.method == 'POST':
+            body = request.get_json(force=True)
+            if not isinstance(body, dict):
+                raise werkzeug.exceptions.BadRequest('Expected a JSON object with "queries"')
+            queries = body.get('queries', [])
+            k = body.get('k', search.DEFAULT_TOP_K)
+            if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+                raise werkzeug.exceptions.BadRequest('"queries" must be a list of strings')
+            if isinstance(k, bool) or not isinstance(k, (int, float)):
+                raise werkzeug.exceptions.BadRequest('"k" must be a number')
+        else:
+            queries = [request.args.get('q', '')]
+            k = request.args.get('k', search.DEFAULT_TOP_K, type=int)
+        queries = [q for q in queries if q.strip()]
+        if not queries:
+            return jsonify({'error': 'No query given'}), 400
+        k = max(1, min(int(k), search.MAX_TOP_K))
+
+        matches = search_index.search(embedder.embed(queries), k)
+        return jsonify({
+            'results': [
+                {
+                    'query': query,
+                    'items': [dict(item, score=score) for item, score in query_matches],
+                }
+                for query, query_matches in zip(queries, matches)
+            ]
+        })
+
+    def get_page(max_limit=MAX_PAGE_SIZE, query=None):
+        limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, max_limit))
+        cursor = request.args.get('cursor')
+        try:
+            if query:
+                return db.search_links(query, limit=limit, cursor=cursor), limit
+            return db.get_links(limit=limit, cursor=cursor), limit
+        except ValueError as e:
+            raise werkzeug.exceptions.BadRequest(str(e))
 
     @app.route('/')
     def home():
-        items = db.get_links()
-
-        return render_template('index.html', count=len(items))
+        return render_template('index.html', count=db.count_links())
 
 
     @app.route('/view')
     def view():
-        items = db.get_links()
+        # keyword search, for the databases that support it
+        can_search = hasattr(db, 'search_links')
+        query = request.args.get('q', '').strip() if can_search else ''
+        (items, next_cursor), limit = get_page(query=query)
+
+        return render_template('view.html', items=items, next_cursor=next_cursor, limit=limit,
+                               query=query, can_search=can_search)
 
-        return render_template('view.html', items=items)
+    def render_rss():
+        (items, next_cursor), limit = get_page(max_limit=RSS_MAX_ITEMS)
+        body = render_template('rss.xml', items=items, next_cursor=next_cursor, limit=limit).encode('utf-8')
+        return {
+            'body': body,
+            'gzipped': gzip.compress(body),
+            'etag': hashlib.sha1(body).hexdigest(),
+        }
 
     @app.route('/rss')
     def rss():
-        items = db.get_links()
+        # feed readers poll this constantly, only re-render when a link was
+        # saved, which other lambda containers see through last_modified
+        last_modified = db.last_modified()
+        key = (request.args.get('limit'), request.args.get('cursor'))
+        feed = rss_cache.get(key)
+        if feed is None or feed['last_modified'] != last_modified:
+            feed = render_rss()
+            feed['last_modified'] = last_modified
+            if len(rss_cache) >= RSS_CACHE_SIZE:
+                rss_cache.clear()
+            rss_cache[key] = feed
+
+        response = Response(feed['body'], mimetype='application/rss+xml')
+        response.set_etag(feed['etag'])
+        if 'gzip' in request.accept_encodings:
+            response.set_data(feed['gzipped'])
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(feed['etag'] + '-gzip')
+        response.vary.add('Accept-Encoding')
+        if last_modified:
+            response.last_modified = last_modified
 
-        return Response(render_template('rss.xml', items=items), mimetype='application/rss+xml')
+        # answers 304 for a matching If-None-Match or If-Modified-Since
+        return response.make_conditional(request)
 
     @app.errorhandler(Exception)
     def handle_error(e):
         if isinstance(e, werkzeug.exceptions.NotFound):
             return render_template('error.html', message='Page not found'), 404
+        elif isinstance(e, werkzeug.exceptions.BadRequest):
+            return render_template('error.html', message=e.description), 400
         else:
             logger.exception(e)
             return render_template('error.html', message=str(e)), 500
 
     return app
 
+def warm_up(app):
+    # compile the templates and open the database connection, so the first
+    # real request doesn't pay for them
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    app.extensions['database'].last_modified()
+
+
+# built on the first invocation and reused while the lambda container is warm
+lambda_app = None
+
+
+def get_lambda_app():
+    global lambda_app
+    if lambda_app is None:
+        # nothing runs after a lambda invocation returns, so extract inline
+        os.environ.setdefault('JOB_QUEUE', 'inline')
+        lambda_app = make_app()
+    return lambda_app
+
+
 def lambda_handler(event, context):
+    app = get_lambda_app()
     if event.get('source', '') == 'keepwarm':
         print("keepwarm")
+        warm_up(app)
         return {'statusCode': 200}
-    return handle_request(make_app(), event, context)
+    return handle_request(app, event, context)
 
 if __name__ == '__main__':
     make_app().run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
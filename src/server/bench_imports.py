@@ -0,0 +1,65 @@
+# Import time profile of the server, the cost every lambda cold start pays
+# before the first request, from python -X importtime in a fresh process.
+#
+#   python bench_imports.py [module] [--top 20] [--max-ms 800]
+#
+# Fails if a module that should only be loaded when a link is extracted gets
+# imported, or the total is over --max-ms.
+import argparse
+import os
+import subprocess
+import sys
+
+# loaded on demand by /api/extract and /api/search, never on import
+LAZY_MODULES = ['langchain', 'openai', 'bs4', 'lxml', 'tiktoken', 'numpy', 'linkyai', 'opengraph', 'search']
+
+
+def profile(module):
+    """
+    Returns {module: (self microseconds, cumulative microseconds)}, and the
+    modules the import left loaded.
+    """
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    env = dict(os.environ)
+    # the server imports database.py from the repository root
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')),
+                                                      env.get('PYTHONPATH')]))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times, set(result.stdout.split())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('module', nargs='?', default='app')
+    parser.add_argument('--top', type=int, default=20, help='slowest top level imports to list')
+    parser.add_argument('--max-ms', type=float, help='fail if importing takes longer than this')
+    args = parser.parse_args()
+
+    times, loaded = profile(args.module)
+    total = times[args.module][1] / 1000
+    print(f"import {args.module}: {total:.1f}ms, {len(times)} modules")
+
+    # the biggest packages, by cumulative time of their top level module
+    packages = {name: cumulative for name, (_, cumulative) in times.items() if '.' not in name}
+    for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if args.max_ms is not None and total > args.max_ms:
+        print(f"FAIL: {total:.1f}ms is over the {args.max_ms:.0f}ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,107 @@
+# Replay synthetic API Gateway events against app.lambda_handler and report
+# the cold start (import and first invocation, in a fresh process) and the
+# warm latency of later invocations in the same container.
+#
+#   python bench_lambda.py [--requests 200] [--rebuild]
+#
+# --rebuild builds a new app for every event, as lambda_handler used to.
+# Uses the in memory database unless DATABASE_TYPE is set.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PATHS = ['/', '/view', '/rss', '/view?limit=10']
+
+
+class Context:
+    function_name = 'bench'
+    memory_limit_in_mb = 512
+    aws_request_id = 'bench'
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:000000000000:function:bench'
+
+
+def make_event(path_and_query):
+    path, _, query = path_and_query.partition('?')
+    params = dict(p.split('=', 1) for p in query.split('&')) if query else None
+    return {
+        'httpMethod': 'GET',
+        'path': path,
+        'resource': '/{proxy+}',
+        'headers': {'Host': 'bench.example.com', 'Accept-Encoding': 'gzip', 'X-Forwarded-Proto': 'https'},
+        'multiValueHeaders': None,
+        'queryStringParameters': params,
+        'multiValueQueryStringParameters': {k: [v] for k, v in params.items()} if params else None,
+        'pathParameters': {'proxy': path.lstrip('/')},
+        'requestContext': {'stage': 'prod', 'path': path, 'identity': {'sourceIp': '127.0.0.1'}},
+        'body': None,
+        'isBase64Encoded': False,
+    }
+
+
+def invoke(event, rebuild):
+    import app
+    if rebuild:
+        app.lambda_app = None
+    start = time.perf_counter()
+    response = app.lambda_handler(event, Context())
+    elapsed = time.perf_counter() - start
+    if response.get('statusCode') != 200:
+        raise RuntimeError(f"{event.get('path', event.get('source'))} answered {response.get('statusCode')}")
+    return elapsed
+
+
+def cold(rebuild, keepwarm):
+    """
+    Runs in a fresh process: time the import and the first event.
+    """
+    start = time.perf_counter()
+    import app  # noqa: F401
+    imported = time.perf_counter() - start
+    if keepwarm:
+        invoke({'source': 'keepwarm'}, rebuild)
+    first = invoke(make_event(PATHS[0]), rebuild)
+    print(json.dumps({'import': imported, 'first': first}))
+
+
+def measure_cold(args, keepwarm=False):
+    command = [sys.executable, __file__, '--cold'] + (['--rebuild'] if args.rebuild else []) + (['--keepwarm'] if keepwarm else [])
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(name, times):
+    times = sorted(times)
+    p95 = times[int(len(times) * 0.95) - 1] if len(times) >= 20 else times[-1]
+    print(f"{name:>12}: mean {statistics.mean(times) * 1000:7.2f}ms  p50 {statistics.median(times) * 1000:7.2f}ms  "
+          f"p95 {p95 * 1000:7.2f}ms  ({len(times)} events)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--rebuild', action='store_true', help='build a new app for every event')
+    parser.add_argument('--cold', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--keepwarm', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_TYPE', 'memory')
+    os.environ.setdefault('JOB_QUEUE', 'inline')
+    import logging
+    logging.disable(logging.INFO)
+
+    if args.cold:
+        cold(args.rebuild, args.keepwarm)
+        sys.exit(0)
+
+    result = measure_cold(args)
+    print(f"{'cold':>12}: import {result['import'] * 1000:7.2f}ms  first event {result['first'] * 1000:7.2f}ms")
+    result = measure_cold(args, keepwarm=True)
+    print(f"{'keepwarm':>12}: import {result['import'] * 1000:7.2f}ms  first event after keepwarm {result['first'] * 1000:7.2f}ms")
+
+    events = [make_event(PATHS[i % len(PATHS)]) for i in range(args.requests)]
+    invoke(events[0], args.rebuild)
+    report('warm' + (' rebuild' if args.rebuild else ''), [invoke(event, args.rebuild) for event in events])
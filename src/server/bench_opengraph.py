@@ -0,0 +1,64 @@
+# Compare the head only opengraph parser with a full BeautifulSoup parse of
+# the page, over generated pages of growing size or saved html pages.
+#
+#   python bench_opengraph.py [fixtures dir]
+import glob
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+import opengraph
+
+REPEAT = 5
+
+
+def make_page(paragraphs):
+    head = (
+        '<html><head><title>A big page</title>'
+        '<meta property="og:title" content="A big page">'
+        '<meta property="og:description" content="Lots of paragraphs">'
+        '<meta property="og:type" content="article">'
+        '<script>' + 'var x = 1;' * 200 + '</script></head>'
+    )
+    body = ''.join(f'<div class="c"><p>Paragraph {i} with <a href="/{i}">a link</a> and some text.</p></div>'
+                   for i in range(paragraphs))
+    return (head + '<body>' + body + '</body></html>').encode('utf-8')
+
+
+def full_parse(html):
+    # what opengraph.py did before
+    doc = BeautifulSoup(html, "html.parser")
+    return {og['property'][3:]: og['content'] for og in doc.html.head.find_all(property=re.compile(r'^og'))
+            if og.has_attr('content')}
+
+
+def head_parse(html):
+    return dict(opengraph.OpenGraph(html=html))
+
+
+def best_of(fn, html):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(html)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(sys.argv[1], '*.html'))):
+            with open(path, 'rb') as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [(f'{n} paragraphs', make_page(n)) for n in [10, 1000, 10000, 50000]]
+
+    for name, html in pages:
+        full = best_of(full_parse, html)
+        head = best_of(head_parse, html)
+        print(f"{name:>24} {len(html) / 1024:8.0f}KB: full {full * 1000:8.2f}ms  head {head * 1000:6.2f}ms  {full / head:6.0f}x")
@@ -0,0 +1,93 @@
+# Compare the prompt tokens of the old page text (BeautifulSoup get_text cut
+# to 8000 characters) with the readable text, over saved html pages.
+#
+#   python bench_readable.py --save urls.txt [fixtures dir]   download the pages first
+#   python bench_readable.py [fixtures dir]
+#
+# fixtures/html has a few pages to run with offline, real pages saved with
+# --save give better numbers.
+import argparse
+import glob
+import hashlib
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+import opengraph
+import readable
+
+OLD_PAGE_TEXT_LENGTH = 8000
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'html')
+
+
+def count_tokens(text):
+    if readable.encoding is None:
+        return len(text) // 4
+    return len(readable.encoding.encode(text, disallowed_special=()))
+
+
+def old_page_text(html):
+    return BeautifulSoup(html, "html.parser").get_text()[:OLD_PAGE_TEXT_LENGTH]
+
+
+def save_pages(urls_file, fixtures):
+    import fetch
+    os.makedirs(fixtures, exist_ok=True)
+    for url in [x.strip() for x in open(urls_file).readlines() if x.strip()]:
+        try:
+            page = fetch.fetch_page(url)
+        except Exception as e:
+            print(f"{url}: {e}")
+            continue
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16] + '.html'
+        with open(os.path.join(fixtures, name), 'wb') as f:
+            f.write(page.content)
+        print(f"{url} -> {name}")
+
+
+def timed(fn, html):
+    start = time.perf_counter()
+    text = fn(html)
+    return text, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixtures', nargs='?', default=FIXTURES, help='directory of .html files')
+    parser.add_argument('--save', metavar='URLS_FILE', help='download the urls into the fixtures directory first')
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.save, args.fixtures)
+
+    files = sorted(glob.glob(os.path.join(args.fixtures, '*.html')))
+    if not files:
+        print(f"No .html files in {args.fixtures}, use --save urls.txt to download some")
+        raise SystemExit(1)
+
+    print(f"tokens with {'tiktoken' if readable.encoding is not None else 'an estimate of 4 chars per token'}, "
+          f"parser {'lxml' if readable.have_lxml else 'html.parser'}, budget {readable.PAGE_TOKEN_BUDGET}")
+    totals = {'raw': 0, 'old': 0, 'new': 0, 'old_seconds': 0, 'new_seconds': 0}
+    for path in files:
+        with open(path, 'rb') as f:
+            content = f.read()
+        # decoded like linkyai.page_text does
+        html = content.decode(opengraph.sniff_encoding(content), errors='replace')
+        old, old_seconds = timed(old_page_text, html)
+        new, new_seconds = timed(readable.html_to_text, html)
+        raw = count_tokens(html)
+        result = {'raw': raw, 'old': count_tokens(old), 'new': count_tokens(new),
+                  'old_seconds': old_seconds, 'new_seconds': new_seconds}
+        for key in totals:
+            totals[key] += result[key]
+        print(f"{os.path.basename(path):>24}: raw {raw:7d}  old {result['old']:5d} ({old_seconds * 1000:6.1f}ms)"
+              f"  new {result['new']:5d} ({new_seconds * 1000:6.1f}ms)")
+
+    n = len(files)
+    print("-" * 60)
+    print(f"per page: raw {totals['raw'] / n:.0f} tokens, old {totals['old'] / n:.0f} tokens "
+          f"in {totals['old_seconds'] / n * 1000:.1f}ms, new {totals['new'] / n:.0f} tokens "
+          f"in {totals['new_seconds'] / n * 1000:.1f}ms")
+    if totals['old']:
+        print(f"readable text uses {1 - totals['new'] / totals['old']:.0%} fewer page tokens than before")
@@ -0,0 +1,55 @@
+# Compare the combined (one completion) and separate (two completions) summary
+# modes: latency, tokens and cost per link, over the urls in urls.txt.
+#
+#   python bench_summarise.py [urls.txt]
+import sys
+import time
+import logging
+
+from langchain.callbacks import get_openai_callback
+
+import fetch
+import linkyai
+
+MODES = ['separate', 'combined']
+
+
+def measure(url, og_string, mode, page):
+    start = time.time()
+    with get_openai_callback() as cb:
+        data = linkyai.summarise_url(url, og_string, mode, page)
+    return {
+        'seconds': time.time() - start,
+        'tokens': cb.total_tokens,
+        'cost': cb.total_cost,
+        'requests': cb.successful_requests,
+        'title': data['title'],
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    urls_file = sys.argv[1] if len(sys.argv) > 1 else 'urls.txt'
+    urls = [x.strip() for x in open(urls_file).readlines() if x.strip()]
+
+    totals = {mode: {'seconds': 0, 'tokens': 0, 'cost': 0, 'requests': 0} for mode in MODES}
+    for url in urls:
+        page = fetch.fetch_page(url)
+        og_string = linkyai.get_opengraph_string(url, page)
+        print(url)
+        for mode in MODES:
+            result = measure(url, og_string, mode, page)
+            for key in totals[mode]:
+                totals[mode][key] += result[key]
+            print(f"  {mode:>9}: {result['seconds']:5.1f}s {result['tokens']:6d} tokens ${result['cost']:.4f}  {result['title']}")
+
+    print("-" * 60)
+    for mode in MODES:
+        t = totals[mode]
+        n = max(len(urls), 1)
+        print(f"{mode:>9}: {t['seconds'] / n:5.1f}s {t['tokens'] / n:8.0f} tokens ${t['cost'] / n:.4f} {t['requests'] / n:.1f} requests per link")
+    saved = totals['separate']
+    combined = totals['combined']
+    if saved['tokens'] and saved['seconds']:
+        print(f"combined saves {1 - combined['tokens'] / saved['tokens']:.0%} of the tokens "
+              f"and {1 - combined['seconds'] / saved['seconds']:.0%} of the time")
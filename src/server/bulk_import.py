@@ -0,0 +1,235 @@
+# Import a list of urls, or a browser bookmarks export, summarising several
+# links at once.
+#
+#   python bulk_import.py bookmarks.html [--concurrency 8] [--per-host 2] [--host-delay 1]
+#
+# Set DATABASE_TYPE (and DATABASE_PATH) to the app's database. The in memory
+# database is gone when the import exits, so it needs --allow-memory.
+#
+# Every finished url is appended to a progress file (<input>.progress by
+# default) once it is written to the database, so an interrupted import picks
+# up where it stopped when run again. Failed urls are tried again on the next
+# run.
+#
+# The same parsing is used by POST /api/import, which queues the urls for the
+# extraction workers instead.
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from itertools import zip_longest
+from urllib.parse import urlsplit
+import logging
+logger = logging.getLogger(__name__)
+
+import database
+
+DEFAULT_CONCURRENCY = 8
+# requests in flight to one host, and seconds between starting them
+DEFAULT_PER_HOST = 2
+DEFAULT_HOST_DELAY = 1.0
+# links written to the database at a time, the dynamodb batch size
+BATCH_SIZE = 25
+MAX_IMPORT_URLS = 10000
+
+SAVED = 'saved'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.urls.append(href)
+
+
+def parse_urls(text):
+    """
+    The http(s) urls in a bookmarks export (the netscape html every browser
+    exports), or in a list with one url per line. Links with the same
+    canonical url are only kept once.
+    """
+    if '<a ' in text.lower():
+        parser = _LinkParser()
+        parser.feed(text)
+        parser.close()
+        candidates = parser.urls
+    else:
+        candidates = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+
+    urls = []
+    seen = set()
+    for url in candidates:
+        if urlsplit(url).scheme not in ('http', 'https'):
+            continue
+        key = database.canonical_url(url)
+        if key not in seen:
+            seen.add(key)
+            urls.append(url)
+    return urls
+
+
+def interleave_hosts(urls):
+    """
+    Order the urls round robin by host, so the workers aren't all waiting on
+    the same site.
+    """
+    by_host = {}
+    for url in urls:
+        by_host.setdefault(urlsplit(url).hostname, []).append(url)
+    return [url for group in zip_longest(*by_host.values()) for url in group if url is not None]
+
+
+class HostLimiter:
+    """
+    At most `per_host` requests in flight to a host, started at least
+    `delay` seconds apart.
+    """
+
+    def __init__(self, per_host=DEFAULT_PER_HOST, delay=DEFAULT_HOST_DELAY):
+        self.per_host = per_host
+        self.delay = delay
+        self.lock = threading.Lock()
+        # host -> [semaphore, earliest start of the next request]
+        self.hosts = {}
+
+    @contextmanager
+    def slot(self, url):
+        host = urlsplit(url).hostname
+        with self.lock:
+            state = self.hosts.setdefault(host, [threading.Semaphore(self.per_host), 0])
+        with state[0]:
+            with self.lock:
+                now = time.time()
+                wait = state[1] - now
+                state[1] = max(state[1], now) + self.delay
+            if wait > 0:
+                time.sleep(wait)
+            yield
+
+
+def load_progress(path):
+    """
+    The urls finished by an earlier run, saved or skipped.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash
+                continue
+            if entry.get('status') in (SAVED, SKIPPED):
+                done.add(entry['url'])
+    return done
+
+
+def run_import(db, urls, progress_path, extract, concurrency=DEFAULT_CONCURRENCY,
+               per_host=DEFAULT_PER_HOST, host_delay=DEFAULT_HOST_DELAY, on_saved=None):
+    """
+    Summarise and save the urls not finished in an earlier run. `extract`
+    turns a url into {'title', 'summary'}. Returns the count of every status.
+    """
+    done = load_progress(progress_path)
+    todo = interleave_hosts([url for url in urls if url not in done])
+    logger.info(f"Importing {len(todo)} urls, {len(urls) - len(todo)} already done")
+
+    limiter = HostLimiter(per_host, host_delay)
+    counts = {SAVED: 0, SKIPPED: 0, FAILED: 0}
+    pending = []
+
+    def work(url):
+        # known links, maybe saved with other tracking parameters, aren't
+        # summarised again
+        if db.find_url(url) is not None:
+            return None
+        with limiter.slot(url):
+            return extract(url)
+
+    with open(progress_path, 'a') as progress:
+        def record(entries):
+            for entry in entries:
+                counts[entry['status']] += 1
+                progress.write(json.dumps(entry) + '\n')
+            progress.flush()
+
+        def flush():
+            # only marked done once they are in the database
+            saved = {item['url'] for item in db.save_urls(pending)}
+            record([{'url': item['url'], 'status': SAVED if item['url'] in saved else SKIPPED} for item in pending])
+            if on_saved is not None:
+                for item in pending:
+                    if item['url'] in saved:
+                        on_saved(item['url'], item)
+            pending.clear()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(work, url): url for url in todo}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logger.warning(f"Failed to import {url}: {e}")
+                    record([{'url': url, 'status': FAILED, 'error': str(e)}])
+                    continue
+                if data is None:
+                    record([{'url': url, 'status': SKIPPED}])
+                    continue
+                pending.append({'url': url, 'title': data['title'], 'summary': data['summary']})
+                if len(pending) >= BATCH_SIZE:
+                    flush()
+                    logger.info(f"{sum(counts.values())}/{len(todo)} done: {counts}")
+        if pending:
+            flush()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='bookmarks html export, or a file with one url per line')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST, help='requests in flight to one host')
+    parser.add_argument('--host-delay', type=float, default=DEFAULT_HOST_DELAY, help='seconds between requests to one host')
+    parser.add_argument('--progress', help='progress file, defaults to <input>.progress')
+    parser.add_argument('--allow-memory', action='store_true',
+                        help='import into the in memory database, which is lost on exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    import app
+    import worker
+
+    # refused before any summary is paid for, the progress file would mark
+    # every url done while nothing was kept
+    db = app.make_database()
+    if isinstance(db, database.InMemoryDatabase) and not args.allow_memory:
+        sys.exit("DATABASE_TYPE is memory, the imported links would be lost on exit. "
+                 "Set DATABASE_TYPE=sqlite or dynamo, or pass --allow-memory")
+
+    with open(args.input, encoding='utf-8', errors='replace') as f:
+        urls = parse_urls(f.read())
+    search_index, embedder = app.make_search()
+
+    def on_saved(url, data):
+        app.index_link(search_index, embedder, url, data)
+
+    counts = run_import(db, urls, args.progress or args.input + '.progress', worker.extract,
+                        args.concurrency, args.per_host, args.host_delay, on_saved)
+    if search_index is not None:
+        search_index.save()
+    print(f"Imported {len(urls)} urls: {counts[SAVED]} saved, {counts[SKIPPED]} already saved, {counts[FAILED]} failed")
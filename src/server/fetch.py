@@ -0,0 +1,132 @@
+import time
+import codecs
+import threading
+import email.message
+import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import chardet
+import logging
+logger = logging.getLogger(__name__)
+
+# (connect, read) seconds
+FETCH_TIMEOUT = (5, 20)
+# pages are cut off after this many bytes
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+# fetched pages are kept this long, so retries don't download them again
+CACHE_TTL = 300
+CACHE_SIZE = 64
+# bytes looked at to guess the charset of a page that doesn't declare one
+DETECT_BYTES = 64 * 1024
+
+default_request_headers = requests.utils.default_headers()
+default_request_headers.update({
+    'User-Agent': 'LinkyAI/0.1'
+})
+
+# one pooled session for every fetch, so connections are reused
+session = requests.Session()
+session.headers.update(default_request_headers)
+session.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class Page:
+    def __init__(self, url, status, headers, content, encoding, truncated=False):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.truncated = truncated
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status} fetching {self.url}")
+
+
+def header_charset(content_type):
+    """
+    The charset in a Content-Type header, None if there is none. Unlike
+    response.encoding, which is ISO-8859-1 for any text/* without one.
+    """
+    if not content_type:
+        return None
+    message = email.message.Message()
+    message['content-type'] = content_type
+    charset = message.get_param('charset')
+    if not isinstance(charset, str):
+        return None
+    try:
+        return codecs.lookup(charset.strip()).name
+    except LookupError:
+        return None
+
+
+def detect_encoding(content):
+    # most pages are utf-8, which is much cheaper to check than to guess
+    head = content[:DETECT_BYTES]
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return chardet.detect(head)['encoding']
+
+
+def download(url):
+    with session.get(url, timeout=FETCH_TIMEOUT, stream=True) as response:
+        chunks = []
+        size = 0
+        truncated = False
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= MAX_PAGE_BYTES:
+                truncated = True
+                break
+        content = b''.join(chunks)[:MAX_PAGE_BYTES]
+        if truncated:
+            logger.warning(f"Page {url} is larger than {MAX_PAGE_BYTES} bytes, truncated")
+        # the charset from the headers, or a guess from the content. a
+        # <meta charset> still wins over both, see opengraph.sniff_encoding.
+        # response.apparent_encoding can't be used, the stream is consumed
+        encoding = header_charset(response.headers.get('content-type')) or detect_encoding(content)
+        return Page(response.url, response.status_code, dict(response.headers), content, encoding, truncated)
+
+
+def fetch_page(url):
+    """
+    Download a page once and share it between the opengraph parser and the
+    summariser. Successful pages are cached for CACHE_TTL seconds.
+    """
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(url)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+    logger.debug(f"Fetching {url}")
+    page = download(url)
+
+    if not page.ok:
+        # a retry should fetch an error page again, not reuse it
+        return page
+
+    with _cache_lock:
+        # drop expired pages, then the oldest if still full
+        for key in [key for key, (expires, _) in _cache.items() if expires <= now]:
+            del _cache[key]
+        if len(_cache) >= CACHE_SIZE:
+            del _cache[min(_cache, key=lambda key: _cache[key][0])]
+        _cache[url] = (now + CACHE_TTL, page)
+    return page
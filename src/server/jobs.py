@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+import database
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# a running job not finished after this long is assumed to have lost its worker
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 300))
+MAX_ATTEMPTS = 3
+
+
+class SqliteJobQueue:
+    """
+    Extraction jobs in a local sqlite database, shared by the web process and
+    any number of worker processes on the same machine.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    canonical_url TEXT,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+            if 'canonical_url' not in columns:
+                # jobs tables from before urls were deduplicated by canonical url
+                conn.execute('ALTER TABLE jobs ADD COLUMN canonical_url TEXT')
+                conn.executemany('UPDATE jobs SET canonical_url = ? WHERE id = ?', [
+                    (database.canonical_url(row['url']), row['id'])
+                    for row in conn.execute('SELECT id, url FROM jobs').fetchall()
+                ])
+            conn.execute('DROP INDEX IF EXISTS jobs_url')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_canonical_url ON jobs (canonical_url)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+    def connection(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return _Transaction(conn)
+
+    def enqueue(self, url):
+        """
+        Returns the job for the url, reusing a queued or running job for the
+        same canonical url instead of extracting it again. Finished jobs
+        aren't reused, saved links are answered by the database, and a link
+        missing from it (e.g. the in memory database after a restart) has to
+        be extracted again.
+        """
+        now = time.time()
+        key = database.canonical_url(url)
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE canonical_url = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1',
+                (key, QUEUED, RUNNING)
+            ).fetchone()
+            if row is not None:
+                return _job(row)
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                'INSERT INTO jobs (id, url, canonical_url, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, url, key, QUEUED, now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self.connection() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return _job(row) if row is not None else None
+
+    def claim(self):
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND updated_at < ?',
+                (QUEUED, now, RUNNING, now - JOB_TIMEOUT)
+            )
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                (RUNNING, now, row['id'])
+            )
+        return self.get(row['id'])
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        job = self.get(job_id)
+        status = FAILED if job is None or job['attempts'] >= MAX_ATTEMPTS else QUEUED
+        self._finish(job_id, status, error=str(error))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self.connection() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?',
+                (status, result, error, time.time(), job_id)
+            )
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        # take the write lock up front, so two workers can't claim the same job
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def _job(row):
+    job = dict(row)
+    job.pop('canonical_url', None)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+class RedisJobQueue:
+    """
+    The same queue in redis, for workers on other machines.
+    """
+
+    def __init__(self, url, prefix='linky:jobs'):
+        import redis
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self.queue_key = f'{prefix}:queue'
+        # the ids of claimed jobs, until they are finished
+        self.processing_key = f'{prefix}:processing'
+        self.claim_script = self.client.register_script(self.CLAIM_SCRIPT)
+
+    def job_key(self, job_id):
+        return f'{self.prefix}:job:{job_id}'
+
+    def url_key(self, url):
+        # the same link with other tracking parameters shares the job
+        key = database.canonical_url(url)
+        return f'{self.prefix}:url:{hashlib.sha256(key.encode("utf-8")).hexdigest()}'
+
+    def enqueue(self, url):
+        job_id = uuid.uuid4().hex
+        url_key = self.url_key(url)
+        # only one unfinished job per url
+        if not self.client.set(url_key, job_id, nx=True):
+            existing = self.get(self.client.get(url_key).decode('utf-8'))
+            if existing is not None and existing['status'] in (QUEUED, RUNNING):
+                return existing
+            self.client.set(url_key, job_id)
+
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.hset(self.job_key(job_id), mapping={
+            'id': job_id, 'url': url, 'status': QUEUED, 'attempts': 0,
+            'created_at': now, 'updated_at': now,
+        })
+        pipe.lpush(self.queue_key, job_id)
+        pipe.execute()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        data = self.client.hgetall(self.job_key(job_id))
+        if not data:
+            return None
+        job = {k.decode('utf-8'): v.decode('utf-8') for k, v in data.items()}
+        job['attempts'] = int(job['attempts'])
+        job['result'] = json.loads(job['result']) if job.get('result') else None
+        return job
+
+    # move the next job to the processing list and mark it running in one
+    # step, so every job in the processing list has a running status
+    CLAIM_SCRIPT = """
+        local job_id = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+        if not job_id then
+            return nil
+        end
+        local job_key = ARGV[1] .. job_id
+        redis.call('HSET', job_key, 'status', ARGV[2], 'updated_at', ARGV[3])
+        redis.call('HINCRBY', job_key, 'attempts', 1)
+        return job_id
+    """
+
+    def claim(self):
+        self.requeue_stale()
+        job_id = self.claim_script(keys=[self.queue_key, self.processing_key],
+                                   args=[f'{self.prefix}:job:', RUNNING, time.time()])
+        if job_id is None:
+            return None
+        return self.get(job_id.decode('utf-8'))
+
+    def requeue_stale(self):
+        """
+        Put running jobs not finished after JOB_TIMEOUT back on the queue,
+        their worker is assumed to have died.
+        """
+        cutoff = time.time() - JOB_TIMEOUT
+        for job_id in self.client.lrange(self.processing_key, 0, -1):
+            job = self.get(job_id.decode('utf-8'))
+            if job is not None and job['status'] == RUNNING and float(job['updated_at']) >= cutoff:
+                continue
+            # only the worker that removes it requeues it
+            if self.client.lrem(self.processing_key, 1, job_id) and job is not None and job['status'] == RUNNING:
+                logger.warning(f"Job {job['id']} timed out, requeueing")
+                pipe = self.client.pipeline()
+                pipe.hset(self.job_key(job['id']), mapping={'status': QUEUED, 'updated_at': time.time()})
+                pipe.lpush(self.queue_key, job['id'])
+                pipe.execute()
+
+    def complete(self, job_id, result):
+        pipe = self.client.pipeline()
+        pipe.hset(self.job_key(job_id), mapping={
+            'status': DONE, 'result': json.dumps(result), 'updated_at': time.time(),
+        })
+        pipe.lrem(self.processing_key, 1, job_id)
+        pipe.execute()
+
+    def fail(self, job_id, error):
+        job = self.get(job_id)
+        retry = job is not None and job['attempts'] < MAX_ATTEMPTS
+        pipe = self.client.pipeline()
+        pipe.hset(self.job_key(job_id), mapping={
+            'status': QUEUED if retry else FAILED, 'error': str(error), 'updated_at': time.time(),
+        })
+        pipe.lrem(self.processing_key, 1, job_id)
+        if retry:
+            pipe.lpush(self.queue_key, job_id)
+        pipe.execute()
+
+
+def make_queue():
+    queue_type = os.environ.get('JOB_QUEUE', 'sqlite')
+    if queue_type == 'redis':
+        return RedisJobQueue(os.environ.get('REDIS_URL', 'redis://localhost:6379'))
+    elif queue_type == 'sqlite':
+        return SqliteJobQueue(os.environ.get('JOB_QUEUE_PATH', 'jobs.sqlite3'))
+    else:
+        # inline, extract during the request
+        return None
@@ -1,27 +1,33 @@
-import requests
 import urllib
 import time
+import re
+import json
 import os
 import pprint
 import langchain
 import opengraph
-from langchain.chains import LLMChain, LLMRequestsChain
+import fetch
+import readable
+from langchain.chains import LLMChain
 from langchain.chat_models import ChatOpenAI
+from langchain.callbacks import get_openai_callback
 from langchain.prompts import PromptTemplate
-from langchain.llms import VertexAI
-from langchain import PromptTemplate, LLMChain
 import logging
 logger = logging.getLogger(__name__)
 
-default_request_headers = requests.utils.default_headers()
-default_request_headers.update({
-    'User-Agent': 'LinkyAI/0.1'
-})
 #langchain.debug = True
 
-template = """Within the markdown block below is the full content of a website I am interested in. The url is {my_url} . For single page applications (SPAs), this may be empty or incomplete.
+# combined asks for the title and summary in one completion, separate uses
+# one completion for each
+SUMMARY_MODE = os.environ.get('SUMMARY_MODE', 'combined')
 
-```html
+summary_query = 'What is the article about in a paragraph?'
+title_query = 'Provide a short title for the article. Just provide the title. Suitable for a newspaper headline. Just the title please, dont put quotes around the title.'
+combined_query = 'Provide a short title for the article, suitable for a newspaper headline, and a paragraph about what the article is about. Respond with only a JSON object with the keys "title" and "summary"'
+
+template = """Within the markdown block below is the readable text of a website I am interested in, without the markup, scripts and navigation. The url is {my_url} . For single page applications (SPAs), this may be empty or incomplete.
+
+```
 {requests_result}
 ```
 
@@ -41,7 +47,8 @@ def get_llm_summary(chain, inputs):
     last_error = None
     while (not content.strip() or content == "") and num_tries > 0:
         try:
-            content = chain(inputs)['output']
+            content = chain(inputs)['text']
+            last_error = None
             num_tries -= 1
         except Exception as e:
             num_tries -= 1
@@ -53,11 +60,15 @@ def get_llm_summary(chain, inputs):
         raise last_error
     return content.strip()
 
-def get_opengraph_string(url):
+def get_opengraph_string(url, page=None):
     og_string = "No opengraph data found"
     try:
         logger.debug(f"Opengraph {url}")
-        og_data = opengraph.OpenGraph(url=url)
+        if page is None:
+            page = fetch.fetch_page(url)
+        if page.status in [403, 404, 406]:
+            return og_string
+        og_data = opengraph.OpenGraph(html=page.content, encoding=page.encoding)
         if og_data.is_valid():
             ignore_attrs = ['scrape' , '_url', 'image', 'image:width', 'image:height']
             og_string = ""
@@ -65,25 +76,27 @@ def get_opengraph_string(url):
                 if key not in ignore_attrs:
                     og_string += f"\n{key}: {value}"
         return og_string
-    except urllib.error.HTTPError as e:
-        if e.code == 404 or e.code == 403 or e.code == 406:
-            return og_string
-        else:
-            logger.exception(e)
-            raise e
     except Exception as e:
         logger.exception(e)
         return og_string
 
-def get_summary(url):
-    # gather opengraph data
-    og_string = get_opengraph_string(url)
+def get_summary(url, mode=None):
+    start = time.time()
+    with get_openai_callback() as cb:
+        # download the page once, for both the opengraph data and the summary
+        page = fetch.fetch_page(url)
+        # don't summarise and save an error page as a bookmark
+        page.raise_for_status()
 
-    # call LLM to provide the summary
-    return summarise_url(url, og_string)
+        # gather opengraph data
+        og_string = get_opengraph_string(url, page)
 
-def summarise_url(url, og_string):
-    logger.debug(f"Summarising {url}")
+        # call LLM to provide the summary
+        data = summarise_url(url, og_string, mode, page)
+    logger.info(f"Summarised {url} in {time.time() - start:.1f}s, {cb.total_tokens} tokens (${cb.total_cost:.4f})")
+    return data
+
+def make_chain():
     PROMPT = PromptTemplate(
         input_variables=["query", "requests_result", "og_string", "my_url"],
         template=template,
@@ -92,31 +105,84 @@ def summarise_url(url, og_string):
     # setup langchain
     llm = ChatOpenAI(model_name='gpt-3.5-turbo')
     #llm = VertexAI(max_output_tokens=1024)
-    chain = LLMRequestsChain(llm_chain = LLMChain(llm=llm, prompt=PROMPT))
+    return LLMChain(llm=llm, prompt=PROMPT)
+
+def page_text(page):
+    # the readable text only, cut to readable.PAGE_TOKEN_BUDGET tokens. lxml
+    # takes bytes without a <meta charset> for latin-1, so decode them with
+    # the charset from the headers first
+    html = page.content.decode(opengraph.sniff_encoding(page.content, page.encoding), errors='replace')
+    return readable.html_to_text(html)
+
+def clean_title(title):
+    # if starts with a quote
+    if title.startswith('"'):
+        title = title[1:]
+    # if ends with a quote
+    if title.endswith('"'):
+        title = title[:-1]
+    return title
+
+def parse_title_summary(content):
+    """
+    Parse the combined response, returns None if it isn't a JSON object with
+    a title and a summary. Tolerates markdown fences or text around the JSON.
+    """
+    match = re.search(r'\{.*\}', content, re.DOTALL)
+    if match is None:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    title = data.get('title')
+    summary = data.get('summary')
+    if not isinstance(title, str) or not isinstance(summary, str) or not title.strip() or not summary.strip():
+        return None
+    return {
+        'summary': summary.strip(),
+        'title': clean_title(title.strip()),
+    }
+
+def summarise_url(url, og_string, mode=None, page=None):
+    logger.debug(f"Summarising {url}")
+    chain = make_chain()
+    mode = mode or SUMMARY_MODE
+    if page is None:
+        page = fetch.fetch_page(url)
+        page.raise_for_status()
+    requests_result = page_text(page)
+
+    if mode == 'combined':
+        inputs = {
+            "query": combined_query,
+            "og_string": og_string,
+            "requests_result": requests_result,
+            "my_url": url
+        }
+        data = parse_title_summary(get_llm_summary(chain, inputs))
+        if data is not None:
+            return data
+        logger.warning(f"Could not parse the combined summary for {url}, asking separately")
 
     data = {}
     inputs = {
-        "query": 'What is the article about in a paragraph?',
+        "query": summary_query,
         "og_string": og_string,
-        "url": url,
+        "requests_result": requests_result,
         "my_url": url
     }
     data['summary'] = get_llm_summary(chain, inputs)
 
     inputs = {
-        "query": 'Provide a short title for the article. Just provide the title. Suitable for a newspaper headline. Just the title please, dont put quotes around the title.',
+        "query": title_query,
         "og_string": og_string,
-        "url": url,
+        "requests_result": requests_result,
         "my_url": url
     }
-    data['title'] = get_llm_summary(chain, inputs)
-    # if starts with a quote
-    if data['title'].startswith('"'):
-        data['title'] = data['title'][1:]
-    # if ends with a quote
-    if data['title'].endswith('"'):
-        data['title'] = data['title'][:-1]
-
+    data['title'] = clean_title(get_llm_summary(chain, inputs))
 
     return data
 
@@ -5,7 +5,8 @@
 # encoding: utf-8
 
 import re
-from urllib.request import urlopen
+import codecs
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup
 
 global import_json
@@ -15,6 +16,81 @@ try:
 except ImportError:
     import_json = False
 
+# the head is read in chunks of this many bytes, so a big page is never
+# decoded or parsed past its head
+CHUNK_SIZE = 16 * 1024
+
+# tags that can only be in the body, for pages without a </head>
+BODY_TAGS = {'body', 'div', 'p', 'main', 'article', 'section', 'header', 'nav', 'h1', 'h2', 'table', 'ul', 'img'}
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _HeadParser(HTMLParser):
+    """
+    Collects the og meta tags and stops at the end of the head.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.og = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attrs = dict(attrs)
+            prop = attrs.get('property') or ''
+            if prop.startswith('og') and attrs.get('content') is not None:
+                self.og.append((prop, attrs['content']))
+        elif tag in BODY_TAGS:
+            raise _StopParsing()
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            raise _StopParsing()
+
+
+CHARSET_RE = re.compile(rb'''<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)''', re.IGNORECASE)
+
+
+def sniff_encoding(html, default=None):
+    """
+    The charset declared by a <meta charset> or http-equiv tag in the first
+    1024 bytes, like browsers do, otherwise `default`, otherwise utf-8.
+    """
+    if html.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    match = CHARSET_RE.search(html[:1024])
+    for encoding in [match.group(1).decode('ascii') if match else None, default]:
+        if encoding:
+            try:
+                return codecs.lookup(encoding).name
+            except LookupError:
+                pass
+    return 'utf-8'
+
+
+def parse_head(html, encoding=None):
+    """
+    The (property, content) of every og meta tag in the head of `html`, bytes
+    or str. Only reads as far as the end of the head. Bytes are decoded with
+    the charset the page declares, or `encoding` if it declares none.
+    """
+    parser = _HeadParser()
+    if isinstance(html, str):
+        decode = lambda chunk: chunk
+    else:
+        decode = codecs.getincrementaldecoder(sniff_encoding(html, encoding))(errors='replace').decode
+    try:
+        for i in range(0, len(html), CHUNK_SIZE):
+            parser.feed(decode(html[i:i + CHUNK_SIZE]))
+        parser.close()
+    except _StopParsing:
+        pass
+    return parser.og
+
+
 class OpenGraph(dict):
     """
     """
@@ -22,7 +98,7 @@ class OpenGraph(dict):
     # change made by me - we only care about a title or description ?
     required_attrs = []
 
-    def __init__(self, url=None, html=None, scrape=False, **kwargs):
+    def __init__(self, url=None, html=None, scrape=False, encoding=None, **kwargs):
         # If scrape == True, then will try to fetch missing attribtues
         # from the page's body
 
@@ -38,7 +114,7 @@ class OpenGraph(dict):
             self.fetch(url)
             
         if html is not None:
-            self.parser(html)
+            self.parser(html, encoding)
 
     def __setattr__(self, name, val):
         self[name] = val
@@ -49,21 +125,29 @@ class OpenGraph(dict):
     def fetch(self, url):
         """
         """
-        raw = urlopen(url)
-        html = raw.read()
-        return self.parser(html)
+        # change made by me - use the shared page cache instead of urlopen
+        import fetch
+        page = fetch.fetch_page(url)
+        return self.parser(page.content, page.encoding)
         
-    def parser(self, html):
+    def parser(self, html, encoding=None):
         """
         """
+        # change made by me - only the head is parsed, unless scraping needs
+        # the whole document
         if not isinstance(html,BeautifulSoup):
+            for prop, content in parse_head(html, encoding):
+                self[prop[3:]] = content
+            if self.is_valid() or not self.scrape:
+                return
             doc = BeautifulSoup(html, "html.parser")
         else:
             doc = html
-        ogs = doc.html.head.findAll(property=re.compile(r'^og'))
-        for og in ogs:
-            if og.has_attr(u'content'):
-                self[og[u'property'][3:]]=og[u'content']
+            head = doc.head or doc
+            ogs = head.findAll(property=re.compile(r'^og'))
+            for og in ogs:
+                if og.has_attr(u'content'):
+                    self[og[u'property'][3:]]=og[u'content']
         # Couldn't fetch all attrs from og tags, try scraping body
         if not self.is_valid() and self.scrape:
             for attr in self.required_attrs:
@@ -106,7 +190,7 @@ class OpenGraph(dict):
 
     def scrape_image(self, doc):
         images = [dict(img.attrs)['src']
-            for img in doc.html.body.findAll('img')]
+            for img in (doc.body or doc).findAll('img') if img.has_attr('src')]
 
         if images:
             return images[0]
@@ -114,7 +198,7 @@ class OpenGraph(dict):
         return u''
 
     def scrape_title(self, doc):
-        return doc.html.head.title.text
+        return doc.title.text if doc.title else u''
 
     def scrape_type(self, doc):
         return 'other'
@@ -123,6 +207,6 @@ class OpenGraph(dict):
         return self._url
 
     def scrape_description(self, doc):
-        tag = doc.html.head.findAll('meta', attrs={"name":"description"})
+        tag = (doc.head or doc).findAll('meta', attrs={"name":"description"})
         result = "".join([t['content'] for t in tag])
         return result
@@ -0,0 +1,100 @@
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import lxml.html
+    have_lxml = True
+except ImportError:
+    have_lxml = False
+
+try:
+    import tiktoken
+    encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # not installed, or the encoding file couldn't be downloaded
+    encoding = None
+
+# tokens of page content put in the prompt
+PAGE_TOKEN_BUDGET = int(os.environ.get('PAGE_TOKEN_BUDGET', 2500))
+
+# never readable content, or page chrome around it
+DROP_TAGS = [
+    'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe',
+    'nav', 'header', 'footer', 'aside', 'form', 'button', 'select',
+]
+# tags that break the text into lines
+BLOCK_TAGS = [
+    'p', 'div', 'section', 'article', 'main', 'li', 'tr', 'br', 'pre', 'blockquote',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'dt', 'dd', 'figcaption', 'td', 'th',
+]
+# an article or main element with less text than this is probably not the content
+MIN_CONTENT_CHARS = 200
+
+
+def clean_lines(text):
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def extract_lxml(html):
+    doc = lxml.html.fromstring(html)
+    title = doc.findtext('.//title') or ''
+    for el in doc.xpath('|'.join(f'//{tag}' for tag in DROP_TAGS + ['head'])):
+        el.drop_tree()
+    for el in doc.iter(*BLOCK_TAGS):
+        el.tail = '\n' + (el.tail or '')
+
+    text = ''
+    for candidate in doc.xpath('//article') + doc.xpath('//main'):
+        text = clean_lines(candidate.text_content())
+        if len(text) >= MIN_CONTENT_CHARS:
+            break
+    if len(text) < MIN_CONTENT_CHARS:
+        text = clean_lines(doc.text_content())
+    return title.strip(), text
+
+
+def extract_bs4(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text() if soup.title else ''
+    for el in soup.find_all(DROP_TAGS + ['head']):
+        el.decompose()
+
+    text = ''
+    for candidate in soup.find_all(['article', 'main']):
+        text = clean_lines(candidate.get_text('\n'))
+        if len(text) >= MIN_CONTENT_CHARS:
+            break
+    if len(text) < MIN_CONTENT_CHARS:
+        text = clean_lines(soup.get_text('\n'))
+    return title.strip(), text
+
+
+def truncate_tokens(text, max_tokens):
+    if encoding is None:
+        # roughly 4 characters per token for english
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def html_to_text(html, max_tokens=PAGE_TOKEN_BUDGET):
+    """
+    The readable text of a page, without scripts, styles, navigation and
+    markup, cut to `max_tokens` tokens for the prompt.
+    """
+    if not html or not html.strip():
+        return ''
+    try:
+        title, text = extract_lxml(html) if have_lxml else extract_bs4(html)
+    except Exception as e:
+        # lxml refuses some documents, e.g. ones that are only a comment
+        logger.debug(f"Falling back to BeautifulSoup: {e}")
+        title, text = extract_bs4(html)
+    if title and not text.startswith(title):
+        text = f"{title}\n{text}"
+    return truncate_tokens(text, max_tokens)
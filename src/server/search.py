@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 100
+# seconds to wait before writing newly indexed links
+SAVE_DELAY = 5
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class SearchIndex:
+    """
+    In memory semantic search over the saved links.
+
+    The embeddings are kept as one normalized float32 matrix, so a batch of
+    queries is a single matrix product, and the top k of every query is
+    picked with argpartition instead of sorting all the scores.
+
+    On disk the index is an append only log, shared by every process using
+    the same path (the app and any worker.py):
+
+      <path>.f32         raw float32 vectors, one row per added link
+      <path>.meta.json   one json item per row
+      <path>.state.json  dim, and the rows and meta bytes that are committed
+
+    Saving appends only the links added since the last save, under a file
+    lock, after reading in what other processes appended. A link added again
+    is appended again, the last row for a url wins.
+    """
+
+    def __init__(self, path=None, dim=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.vectors = np.empty((0, dim or 0), dtype=np.float32)
+        self.count = 0
+        self.items = []
+        self.positions = {}
+        # (item, vector) added since the last save
+        self.unsaved = []
+        # how much of the files is already in memory
+        self.synced_rows = 0
+        self.synced_bytes = 0
+        self.state_mtime = None
+        self.save_timer = None
+        # serializes reading and writing the files within this process
+        self.sync_lock = threading.Lock()
+        if path:
+            self._migrate()
+            self.refresh()
+
+    def __len__(self):
+        return self.count
+
+    def _state(self):
+        try:
+            with open(self.path + '.state.json') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_state(self, state):
+        with open(self.path + '.state.json.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.state.json.tmp', self.path + '.state.json')
+
+    def _migrate(self):
+        # indexes saved before the append only log were one .npy matrix
+        if os.path.exists(self.path + '.state.json') or not os.path.exists(self.path + '.npy'):
+            return
+        vectors = np.load(self.path + '.npy')
+        with open(self.path + '.meta.json') as f:
+            items = [json.loads(line) for line in f if line.strip()]
+        os.replace(self.path + '.meta.json', self.path + '.meta.json.old')
+        if items:
+            self.add(items, vectors)
+            self.save()
+        os.remove(self.path + '.npy')
+        os.remove(self.path + '.meta.json.old')
+        logger.info(f"Converted search index {self.path} to the append only layout")
+
+    def refresh(self):
+        """
+        Read in the rows other processes saved since we last looked. Cheap
+        when nothing changed, a stat of the state file.
+        """
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path + '.state.json').st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.state_mtime:
+            return
+        with self.sync_lock:
+            self._read_new_rows(self._state())
+            self.state_mtime = mtime
+
+    def _read_new_rows(self, state):
+        if state is None or state['rows'] <= self.synced_rows:
+            return
+        dim = state['dim']
+        rows = state['rows'] - self.synced_rows
+        with open(self.path + '.f32', 'rb') as f:
+            f.seek(self.synced_rows * dim * 4)
+            vectors = np.frombuffer(f.read(rows * dim * 4), dtype=np.float32).reshape(rows, dim)
+        with open(self.path + '.meta.json', 'rb') as f:
+            f.seek(self.synced_bytes)
+            lines = f.read(state['meta_bytes'] - self.synced_bytes).decode('utf-8').splitlines()
+        items = [json.loads(line) for line in lines if line.strip()]
+
+        with self.lock:
+            self._upsert(items, normalize(vectors))
+            # our own unsaved changes are newer than anything on disk
+            if self.unsaved:
+                self._upsert([item for item, _ in self.unsaved], np.stack([vector for _, vector in self.unsaved]))
+        self.synced_rows = state['rows']
+        self.synced_bytes = state['meta_bytes']
+        logger.info(f"Search index has {self.count} items after reading {rows} rows from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        import fcntl
+        with self.sync_lock, open(self.path + '.lock', 'w') as lock_file:
+            # other processes append to the same files
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            state = self._state()
+            self._read_new_rows(state)
+            with self.lock:
+                unsaved = self.unsaved
+                self.unsaved = []
+            if not unsaved:
+                return
+
+            dim = len(unsaved[0][1])
+            rows = state['rows'] if state else 0
+            meta_bytes = state['meta_bytes'] if state else 0
+            vectors = np.stack([vector for _, vector in unsaved]).astype(np.float32)
+            meta = ''.join(json.dumps(item) + '\n' for item, _ in unsaved).encode('utf-8')
+            # drop anything past the committed state, left over from a crashed save
+            for suffix, size, data in [('.f32', rows * dim * 4, vectors.tobytes()), ('.meta.json', meta_bytes, meta)]:
+                with open(self.path + suffix, 'ab') as f:
+                    f.truncate(size)
+                    f.write(data)
+            self._write_state({'dim': dim, 'rows': rows + len(unsaved), 'meta_bytes': meta_bytes + len(meta)})
+            self.synced_rows = rows + len(unsaved)
+            self.synced_bytes = meta_bytes + len(meta)
+            self.state_mtime = os.stat(self.path + '.state.json').st_mtime_ns
+
+    def save_soon(self, delay=SAVE_DELAY):
+        """
+        Save within `delay` seconds, so links saved close together are
+        written in one append.
+        """
+        with self.lock:
+            if self.save_timer is not None or not self.path:
+                return
+            self.save_timer = threading.Timer(delay, self._timed_save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def _timed_save(self):
+        with self.lock:
+            self.save_timer = None
+        try:
+            self.save()
+        except Exception as e:
+            logger.exception(e)
+
+    def add(self, items, vectors):
+        vectors = normalize(vectors)
+        with self.lock:
+            self._upsert(items, vectors)
+            self.unsaved.extend(zip(items, vectors))
+
+    def _upsert(self, items, vectors):
+        if self.count == 0 and self.vectors.shape[1] != vectors.shape[1]:
+            self.vectors = np.empty((0, vectors.shape[1]), dtype=np.float32)
+        for item, vector in zip(items, vectors):
+            position = self.positions.get(item['url'])
+            if position is None:
+                position = self.count
+                self._reserve(self.count + 1)
+                self.items.append(item)
+                self.positions[item['url']] = position
+                self.count += 1
+            else:
+                self.items[position] = item
+            self.vectors[position] = vector
+
+    def _reserve(self, size):
+        # grow geometrically so adding one link at a time stays cheap
+        if size <= self.vectors.shape[0]:
+            return
+        capacity = max(size, self.vectors.shape[0] * 2, 64)
+        vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+        vectors[:self.count] = self.vectors[:self.count]
+        self.vectors = vectors
+
+    def search(self, query_vectors, k=DEFAULT_TOP_K):
+        """
+        Returns, for every query vector, a list of (item, score) for its k
+        most similar items, best first.
+        """
+        # pick up links other processes indexed
+        self.refresh()
+        queries = normalize(query_vectors)
+        with self.lock:
+            matrix = self.vectors[:self.count]
+            items = self.items[:self.count]
+        if len(items) == 0:
+            return [[] for _ in range(len(queries))]
+
+        k = min(k, len(items))
+        scores = queries @ matrix.T
+        if k < len(items):
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(len(items)), (len(queries), 1))
+
+        results = []
+        for row, candidates in zip(scores, top):
+            best = candidates[np.argsort(-row[candidates])]
+            results.append([(items[i], float(row[i])) for i in best])
+        return results
+
+
+class Embedder:
+    def __init__(self):
+        from langchain.embeddings import OpenAIEmbeddings
+        self.embeddings = OpenAIEmbeddings()
+
+    def embed(self, texts):
+        return np.asarray(self.embeddings.embed_documents(list(texts)), dtype=np.float32)
+
+
+def item_text(item):
+    return f"## {item['title']}\n\n{item['summary']}"
+
+
+def build_index(items, embedder, path, batch_size=500):
+    index = SearchIndex(path)
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        index.add(batch, embedder.embed([item_text(item) for item in batch]))
+        logger.info(f"Indexed {index.count}/{len(items)} links")
+    index.save()
+    return index
+
+
+if __name__ == '__main__':
+    # (re)build the index from every link in the database
+    import app
+
+    path = os.environ['SEARCH_INDEX_PATH']
+    db = app.make_database()
+    items = [
+        {'url': link['url'], 'title': link['title'], 'summary': link['summary']}
+        for link in db.get_links()[0]
+    ]
+    for suffix in ['.f32', '.meta.json', '.state.json']:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    index = build_index(items, Embedder(), path)
+    print(f"Built search index with {len(index)} links at {path}")
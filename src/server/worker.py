@@ -0,0 +1,92 @@
+# Runs the queued /api/extract jobs: fetch the page, summarise it and save
+# the link.
+#
+#   JOB_QUEUE=sqlite DATABASE_TYPE=dynamo python worker.py
+#
+# The in memory database can't be shared between processes, so with
+# DATABASE_TYPE=memory the app runs its workers as threads instead.
+import os
+import sys
+import time
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+import database
+import jobs
+
+POLL_INTERVAL = 1
+
+
+def extract(url):
+    # langchain and the scraping libraries take seconds to import, so they are
+    # only loaded once there is a link to extract
+    import linkyai
+    data = linkyai.get_summary("http://localhost:8081?url=" + url)
+    logger.info(f"Extracted {data}")
+    return data
+
+
+def extract_and_save(db, url, on_saved=None):
+    # a link saved before, maybe with other tracking parameters, isn't
+    # summarised again
+    existing = db.find_url(url)
+    if existing is not None:
+        logger.info(f"Already saved {url} as {existing['url']}")
+        return {'title': existing['title'], 'summary': existing['summary']}
+
+    data = extract(url)
+
+    # False when another worker saved the same link meanwhile
+    saved = db.save_url(url, data['title'], data['summary'])
+    if saved and on_saved is not None:
+        on_saved(url, data)
+    return data
+
+
+def run_worker(queue, db, on_saved=None, stop=None):
+    while stop is None or not stop.is_set():
+        job = queue.claim()
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        logger.info(f"Job {job['id']}: extracting {job['url']} (attempt {job['attempts']})")
+        try:
+            data = extract_and_save(db, job['url'], on_saved)
+            queue.complete(job['id'], data)
+        except Exception as e:
+            logger.exception(e)
+            queue.fail(job['id'], e)
+
+
+def start_worker_threads(queue, db, count, on_saved=None):
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=run_worker, args=(queue, db, on_saved), daemon=True, name=f'extract-worker-{i}')
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    import app
+
+    queue = jobs.make_queue()
+    db = app.make_database()
+    if queue is None:
+        print("JOB_QUEUE is inline, there is nothing for a worker to do")
+    elif isinstance(db, database.InMemoryDatabase):
+        # the app can't see links saved in this process
+        sys.exit("DATABASE_TYPE is memory, the extracted links would be lost. Set DATABASE_TYPE=sqlite or dynamo")
+    else:
+        search_index, embedder = app.make_search()
+
+        def on_saved(url, data):
+            app.index_link(search_index, embedder, url, data)
+
+        count = int(os.environ.get('JOB_WORKER_THREADS', 1))
+        start_worker_threads(queue, db, count, on_saved)
+        while True:
+            time.sleep(60)
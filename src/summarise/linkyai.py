@@ -5,10 +5,14 @@ import time
 import os
 import pprint
 import langchain
+import sys
+import threading
 import redis
+from llmcache import LlmCache
 #import opengraph
 from langchain.chains import LLMChain, LLMRequestsChain
 from langchain.chat_models import ChatOpenAI
+from langchain.callbacks import get_openai_callback
 from langchain.prompts import PromptTemplate
 from langchain.llms import VertexAI
 from langchain import PromptTemplate, LLMChain
@@ -17,6 +21,17 @@ logger = logging.getLogger(__name__)
 
 #langchain.debug = True
 
+MODEL_NAME = 'gpt-3.5-turbo-16k'
+# bump when the template changes, so cached summaries of the old prompt are not reused
+TEMPLATE_VERSION = 1
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 60 * 60 * 24 * 30))
+
+# one connection pool shared by every worker thread
+redis_pool = redis.ConnectionPool.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379'))
+
+_chain = None
+_chain_lock = threading.Lock()
+
 template = """Within the block below is the full content of a page I am interested in. The url is {my_url}.
 
 ```html
@@ -52,17 +67,31 @@ def get_summary(url):
     # call LLM to provide the summary
     return summarise_url(url)
 
-def summarise_url(url, content):
+def redis_client():
+    return redis.StrictRedis(connection_pool=redis_pool)
+
+def get_chain():
+    # built once and shared, the chain holds no per request state
+    global _chain
+    with _chain_lock:
+        if _chain is None:
+            PROMPT = PromptTemplate(
+                input_variables=["content", "my_url"],
+                template=template,
+            )
+
+            # setup langchain
+            llm = ChatOpenAI(model_name=MODEL_NAME)
+            #llm = VertexAI(max_output_tokens=1024)
+            _chain = LLMChain(llm=llm, prompt=PROMPT)
+        return _chain
+
+def make_cache(r):
+    return LlmCache(r, MODEL_NAME, TEMPLATE_VERSION, ttl=LLM_CACHE_TTL)
+
+def summarise_url(url, content, chain=None):
     logger.debug(f"Summarising {url}")
-    PROMPT = PromptTemplate(
-        input_variables=["content", "my_url"],
-        template=template,
-    )
-
-    # setup langchain
-    llm = ChatOpenAI(model_name='gpt-3.5-turbo-16k')
-    #llm = VertexAI(max_output_tokens=1024)
-    chain = LLMChain(llm=llm, prompt=PROMPT)
+    chain = chain or get_chain()
 
     data = {}
     inputs = {
@@ -92,10 +121,11 @@ def test():
         #print("------------------")
 
 
-def event_handler(message):
-    print('Handler received message: ', message)
-    key = message['data']
-    r = redis.StrictRedis(host='localhost', port=6379, db=0)
+def summarise_page(r, cache, key, chain=None):
+    """
+    Summarise the crawled page json stored at `key` into summary:{url}.
+    Returns the url, or None if the page is gone.
+    """
     page = r.get(key)
 
     if page:
@@ -105,19 +135,34 @@ def event_handler(message):
         readable = page['pandocCrawl']['readableArticle']['textContent']
         #readable = page['pandocCrawl']['readableArticle']['content']
         url = page['url']
-        print(f"start summary: {url}")
-        summary = summarise_url(url, readable)
-        print(f"end summary: {url}")
+        # pages are crawled again often, only summarise ones whose text changed
+        summary = cache.get(readable) if readable.strip() else None
+        if summary is not None:
+            print(f"cached summary: {url}")
+        else:
+            print(f"start summary: {url}")
+            with get_openai_callback() as cb:
+                summary = summarise_url(url, readable, chain)
+            print(f"end summary: {url} ({cb.total_tokens} tokens)")
+            if readable.strip():
+                cache.set(readable, summary, cb.total_tokens)
 
         #pprint.pprint(summary)
 
         # set key summary:{url} to the summary
         r.set(f"summary:{page['url']}", json.dumps(summary))
+        return url
+    return None
 
-    #data = get_summary(message['
+def event_handler(message):
+    print('Handler received message: ', message)
+    r = redis_client()
+    summarise_page(r, make_cache(r), message['data'])
 
 def main():
-    r = redis.StrictRedis(host='localhost', port=6379, db=0)
+    # the worker pool in worker.py reads the crawled stream instead, without
+    # losing messages published while it is busy or down
+    r = redis_client()
     p = r.pubsub()
 
     # Subscribe to a topic (channel)
@@ -127,8 +172,16 @@ def main():
         if message is not None and message['type'] == 'message':
             event_handler(message)
 
+def print_cache_stats():
+    stats = make_cache(redis_client()).stats()
+    print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_ratio']:.1%} hit ratio), {stats['saved_tokens']} tokens saved")
+
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ['cache-stats']:
+        print_cache_stats()
+    else:
+        main()
 
 
 
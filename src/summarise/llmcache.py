@@ -0,0 +1,69 @@
+import hashlib
+import json
+
+from redislru import RedisLru
+
+DEFAULT_TTL = 60 * 60 * 24 * 30  # 30 days
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class LlmCache:
+    """
+    Summaries in redis, keyed on the model, the prompt template version and
+    the sha256 of the readable text, so a page crawled again with the same
+    content is not summarised again.
+
+    Entries live under `llmcache:<model>:<template version>:<sha256>`,
+    expired and evicted by RedisLru. Hits, misses and the tokens hits saved
+    are counted in the `llmcache:stats` hash.
+    """
+
+    def __init__(self, client, model, template_version, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, prefix='llmcache'):
+        self.client = client
+        self.prefix = f"{prefix}:{model}:{template_version}"
+        self.lru = RedisLru(client, f"{prefix}:lru", ttl, max_entries)
+        self.stats_key = f"{prefix}:stats"
+
+    def key(self, text):
+        return f"{self.prefix}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get(self, text):
+        """
+        Returns the cached summary for the text, or None.
+        """
+        key = self.key(text)
+        blob = self.client.get(key)
+        pipe = self.client.pipeline(transaction=False)
+        if blob is None:
+            pipe.hincrby(self.stats_key, 'misses', 1)
+            pipe.execute()
+            return None
+
+        entry = json.loads(blob)
+        self.lru.touch(pipe, key)
+        pipe.hincrby(self.stats_key, 'hits', 1)
+        pipe.hincrby(self.stats_key, 'saved_tokens', entry.get('tokens', 0))
+        pipe.execute()
+        return entry['summary']
+
+    def set(self, text, summary, tokens=0):
+        key = self.key(text)
+        pipe = self.client.pipeline(transaction=False)
+        self.lru.add(pipe, key, json.dumps({'summary': summary, 'tokens': tokens}))
+        pipe.execute()
+        self.evict()
+
+    def evict(self):
+        return self.lru.evict()
+
+    def stats(self):
+        data = {k.decode('utf-8'): int(v) for k, v in self.client.hgetall(self.stats_key).items()}
+        hits = data.get('hits', 0)
+        misses = data.get('misses', 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0,
+            'saved_tokens': data.get('saved_tokens', 0),
+        }
@@ -0,0 +1,125 @@
+# Summarise crawled pages with several in flight at once.
+#
+# Pages are read from the stream:crawled redis stream through a consumer
+# group, so entries added while every worker is busy or down wait in the
+# stream instead of being dropped like pub/sub messages. Each entry is
+# {key: <redis key of the crawled page json>}.
+#
+#   python worker.py --concurrency 8 --consumer worker-1
+#
+# An entry is acknowledged once its summary is saved. A failed entry is added
+# again with attempts + 1, and after MAX_ATTEMPTS moved to stream:crawled:dead.
+# Entries left pending by a worker that died are claimed by another after
+# CLAIM_IDLE_MS.
+import argparse
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import logging
+logger = logging.getLogger(__name__)
+
+import redis
+
+import linkyai
+
+STREAM = 'stream:crawled'
+DEAD_STREAM = 'stream:crawled:dead'
+GROUP = 'summarisers'
+MAX_ATTEMPTS = 3
+# pending entries idle this long belong to a worker that died
+CLAIM_IDLE_MS = 10 * 60 * 1000
+CLAIM_INTERVAL = 60
+BLOCK_MS = 1000
+DEFAULT_CONCURRENCY = 4
+
+
+def ensure_group(r):
+    try:
+        r.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def decode_fields(fields):
+    return {k.decode('utf-8'): v.decode('utf-8') for k, v in fields.items()}
+
+
+def claim_stale(r, consumer, count, in_flight):
+    entries = r.xautoclaim(STREAM, GROUP, consumer, min_idle_time=CLAIM_IDLE_MS, start_id='0-0', count=count)[1]
+    # entries deleted from the stream come back without fields
+    return [(entry_id, fields) for entry_id, fields in entries if fields and entry_id not in in_flight]
+
+
+def finish(r, entry_id, fields, error=None):
+    pipe = r.pipeline()
+    if error is not None:
+        attempts = int(fields.get('attempts', 1))
+        if attempts >= MAX_ATTEMPTS:
+            logger.error(f"Giving up on {fields.get('key')} after {attempts} attempts: {error}")
+            pipe.xadd(DEAD_STREAM, {**fields, 'error': str(error)})
+        else:
+            logger.warning(f"Retrying {fields.get('key')} (attempt {attempts}): {error}")
+            pipe.xadd(STREAM, {**fields, 'attempts': attempts + 1})
+    pipe.xack(STREAM, GROUP, entry_id)
+    pipe.execute()
+
+
+def run(concurrency, consumer):
+    r = linkyai.redis_client()
+    ensure_group(r)
+    cache = linkyai.make_cache(r)
+    chain = linkyai.get_chain()
+
+    # future -> (entry id, fields)
+    in_flight = {}
+    last_claim = 0
+
+    def collect(futures):
+        for future in futures:
+            entry_id, fields = in_flight.pop(future)
+            try:
+                url = future.result()
+                logger.info(f"Summarised {url or fields.get('key')}")
+                finish(r, entry_id, fields)
+            except Exception as e:
+                logger.exception(e)
+                finish(r, entry_id, fields, e)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            # backpressure: only read as many entries as there are free workers
+            if len(in_flight) >= concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            else:
+                done = [future for future in in_flight if future.done()]
+            collect(done)
+            free = concurrency - len(in_flight)
+
+            entries = []
+            if time.time() - last_claim > CLAIM_INTERVAL:
+                last_claim = time.time()
+                entries = claim_stale(r, consumer, free, {entry_id for entry_id, _ in in_flight.values()})
+            if not entries:
+                response = r.xreadgroup(GROUP, consumer, {STREAM: '>'}, count=free, block=BLOCK_MS)
+                entries = response[0][1] if response else []
+
+            for entry_id, fields in entries:
+                fields = decode_fields(fields)
+                future = executor.submit(linkyai.summarise_page, r, cache, fields['key'], chain)
+                in_flight[future] = (entry_id, fields)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('SUMMARISE_CONCURRENCY', DEFAULT_CONCURRENCY)),
+                        help='summaries in flight at once')
+    parser.add_argument('--consumer', default=f'{socket.gethostname()}-{os.getpid()}',
+                        help='consumer name in the group, keep it stable across restarts')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('openai').setLevel(logging.WARNING)
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    run(args.concurrency, args.consumer)